@@ -0,0 +1,303 @@
+"""
+Пакетный режим CLI: промпты из JSONL-файла → ответы модели в JSONL-файл, без диалога.
+
+Строка входного файла — объект с полями интерактивного режима: task (обязательно), role,
+context, format, temperature и max_tokens (нет ключа — значение по умолчанию CLI, null — не
+передавать, для reasoning-моделей), плюс необязательный id (по умолчанию — номер строки).
+
+Файл читается построчно, запросы идут через openai_client (ограничитель RPM/TPM, повторы,
+кэш ответов) не более чем по concurrency одновременно. Каждый результат дописывается
+в выходной файл сразу по готовности, поэтому после падения или Ctrl+C повторный запуск
+пропускает id, ответ для которых уже записан; записи с ошибкой при повторе отправляются заново.
+
+    python main.py batch prompts.jsonl -o answers.jsonl --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, TextIO
+
+from config import OPENAI_API_KEY, OPENAI_MODEL
+from main import (
+    DEFAULT_MAX_TOKENS,
+    DEFAULT_TEMPERATURE,
+    TEMPERATURE_MAX,
+    TEMPERATURE_MIN,
+    build_messages,
+)
+from openai_client import close_async_client, get_chat_response_async, init_async_client
+from pricing import usage_cost
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+# Раз в столько завершённых запросов в stderr печатается прогресс
+PROGRESS_EVERY = 100
+
+# Запрос из входного файла: (id, messages, temperature, max_tokens)
+BatchItem = tuple[str, list[dict[str, str]], float | None, int | None]
+
+
+def read_done_ids(path: Path) -> set[str]:
+    """id, для которых в выходном файле уже есть ответ без ошибки (оборванная строка пропускается)."""
+    done: set[str] = set()
+    if not path.exists():
+        return done
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and "id" in record and not record.get("error"):
+                done.add(str(record["id"]))
+    return done
+
+
+def parse_item(data: Any, line_number: int) -> BatchItem:
+    """Проверяет строку входного файла и собирает запрос; ValueError — строка некорректна."""
+    if not isinstance(data, dict):
+        raise ValueError("строка должна быть JSON-объектом")
+    task = str(data.get("task") or "").strip()
+    if not task:
+        raise ValueError("нет обязательного поля task")
+    messages, _ = build_messages(
+        str(data.get("role") or "").strip(),
+        str(data.get("context") or "").strip(),
+        task,
+        str(data.get("format") or "").strip(),
+    )
+
+    temperature = data.get("temperature", DEFAULT_TEMPERATURE)
+    if temperature is not None:
+        if isinstance(temperature, bool) or not isinstance(temperature, (int, float)):
+            raise ValueError("temperature должна быть числом")
+        if not TEMPERATURE_MIN <= temperature <= TEMPERATURE_MAX:
+            raise ValueError(f"temperature вне интервала {TEMPERATURE_MIN} — {TEMPERATURE_MAX}")
+    max_tokens = data.get("max_tokens", DEFAULT_MAX_TOKENS)
+    if max_tokens is not None:
+        if isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens <= 0:
+            raise ValueError("max_tokens должно быть целым положительным числом")
+    item_id = data.get("id", line_number)
+    return str(item_id), messages, temperature, max_tokens
+
+
+def iter_input(path: Path) -> Iterator[tuple[int, str]]:
+    """(номер строки, строка) непустых строк входного файла — без чтения файла целиком."""
+    with path.open(encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                yield line_number, line
+
+
+class BatchRunner:
+    """
+    Прогон входного файла через модель с ограниченной параллельностью.
+
+    Args:
+        output: Открытый на дозапись выходной файл.
+        model: Модель для всех запросов.
+        concurrency: Сколько запросов к модели выполняется одновременно.
+        done: id, которые уже обработаны (пропускаются).
+    """
+
+    def __init__(self, output: TextIO, *, model: str, concurrency: int, done: set[str]) -> None:
+        self.output = output
+        self.model = model
+        self.concurrency = concurrency
+        self.done = done
+        self.stats: dict[str, float] = {
+            "ok": 0,
+            "failed": 0,
+            "invalid": 0,
+            "skipped": 0,
+            "cache_hits": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached_tokens": 0,
+            "reasoning_tokens": 0,
+            "hedge_prompt_tokens": 0,
+            "hedge_completion_tokens": 0,
+        }
+        self.latencies: list[float] = []
+        self._started = time.monotonic()
+
+    async def run(self, input_path: Path) -> None:
+        # Очередь в пару раз больше числа воркеров: файл читается по мере обработки
+        queue: asyncio.Queue[BatchItem | None] = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        try:
+            for line_number, line in iter_input(input_path):
+                item = self._parse_line(line, line_number)
+                if item is not None:
+                    await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def _parse_line(self, line: str, line_number: int) -> BatchItem | None:
+        try:
+            item = parse_item(json.loads(line), line_number)
+        except (json.JSONDecodeError, ValueError) as e:
+            self.stats["invalid"] += 1
+            logger.warning("Строка %s пропущена: %s", line_number, e)
+            return None
+        if item[0] in self.done:
+            self.stats["skipped"] += 1
+            return None
+        # Повтор id внутри файла тоже пропускаем
+        self.done.add(item[0])
+        return item
+
+    async def _worker(self, queue: asyncio.Queue[BatchItem | None]) -> None:
+        while (item := await queue.get()) is not None:
+            await self._process(item)
+
+    async def _process(self, item: BatchItem) -> None:
+        item_id, messages, temperature, max_tokens = item
+        started = time.perf_counter()
+        record: dict[str, Any] = {"id": item_id, "model": self.model}
+        try:
+            content, usage = await get_chat_response_async(
+                messages, self.model, temperature=temperature, max_tokens=max_tokens
+            )
+        except Exception as e:
+            self.stats["failed"] += 1
+            record["error"] = f"{type(e).__name__}: {e}"
+        else:
+            latency = time.perf_counter() - started
+            self.stats["ok"] += 1
+            self.latencies.append(latency)
+            record.update(content=content, usage=usage, latency=round(latency, 3))
+            if usage:
+                self.stats["cache_hits"] += usage.get("cache_hit", 0)
+                for key in ("prompt_tokens", "completion_tokens", "cached_tokens", "reasoning_tokens"):
+                    self.stats[key] += usage[key]
+                self.stats["hedge_prompt_tokens"] += usage.get("hedge_prompt_tokens", 0)
+                self.stats["hedge_completion_tokens"] += usage.get("hedge_completion_tokens", 0)
+        self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.output.flush()
+        processed = self.stats["ok"] + self.stats["failed"]
+        if processed % PROGRESS_EVERY == 0:
+            print(
+                f"  … обработано {processed:.0f} (ошибок {self.stats['failed']:.0f}), "
+                f"{processed / self.elapsed():.1f} запросов/с",
+                file=sys.stderr,
+            )
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+
+def print_summary(runner: BatchRunner) -> None:
+    """Итог прогона: количество, пропускная способность, задержки, токены и стоимость."""
+    stats = runner.stats
+    elapsed = runner.elapsed()
+    processed = stats["ok"] + stats["failed"]
+    ordered = sorted(runner.latencies)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+    cost = sum(
+        usage_cost(runner.model, stats["prompt_tokens"], stats["completion_tokens"], stats["cached_tokens"])
+    )
+    cost += sum(usage_cost(runner.model, stats["hedge_prompt_tokens"], stats["hedge_completion_tokens"]))
+    print("\n  ─── Итог пакетного прогона ───")
+    print(f"    • Модель:                 {runner.model}, параллельно {runner.concurrency}")
+    print(
+        f"    • Запросов:               {stats['ok']:.0f} успешно, {stats['failed']:.0f} с ошибкой, "
+        f"{stats['skipped']:.0f} пропущено (уже есть), {stats['invalid']:.0f} некорректных строк"
+    )
+    print(
+        f"    • Время:                  {elapsed:.1f} с, "
+        f"{processed / elapsed if elapsed else 0.0:.2f} запросов/с"
+    )
+    print(f"    • Задержка p50 / p95 / max: {rank(0.5):.2f} / {rank(0.95):.2f} / {rank(1.0):.2f} с")
+    print(
+        f"    • Токенов:                запросы {stats['prompt_tokens']:,.0f} "
+        f"(из кэша {stats['cached_tokens']:,.0f}), ответы {stats['completion_tokens']:,.0f} "
+        f"(рассуждения {stats['reasoning_tokens']:,.0f}); из кэша ответов {stats['cache_hits']:.0f}"
+    )
+    hedge_tokens = stats["hedge_prompt_tokens"] + stats["hedge_completion_tokens"]
+    if hedge_tokens:
+        print(f"    • Дубли (хеджирование):   {hedge_tokens:,.0f} токенов")
+    print(f"    • Стоимость (ориентир.):  ${cost:.4f}")
+    print("  ─────────────────────────────────────────\n")
+
+
+async def run_batch(input_path: Path, output_path: Path, *, model: str, concurrency: int) -> BatchRunner:
+    """Прогоняет input_path через модель, дописывая результаты в output_path (с продолжением)."""
+    done = read_done_ids(output_path)
+    # После падения посреди записи последняя строка может быть без перевода строки
+    needs_newline = output_path.exists() and output_path.stat().st_size > 0
+    if needs_newline:
+        with output_path.open("rb") as f:
+            f.seek(-1, 2)
+            needs_newline = f.read(1) != b"\n"
+    init_async_client()
+    try:
+        with output_path.open("a", encoding="utf-8") as output:
+            if needs_newline:
+                output.write("\n")
+            runner = BatchRunner(output, model=model, concurrency=concurrency, done=done)
+            try:
+                await runner.run(input_path)
+            finally:
+                print_summary(runner)
+    finally:
+        await close_async_client()
+    return runner
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="main.py batch", description="Пакетный прогон промптов из JSONL через модель"
+    )
+    parser.add_argument(
+        "input", type=Path, help="входной JSONL: task, role, context, format, temperature, max_tokens, id"
+    )
+    parser.add_argument("-o", "--output", type=Path, help="выходной JSONL (по умолчанию <input>.out.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="одновременных запросов")
+    parser.add_argument("--model", default=OPENAI_MODEL, help="модель (по умолчанию OPENAI_MODEL)")
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error("--concurrency должно быть не меньше 1")
+    if args.output is None:
+        args.output = args.input.with_suffix(".out.jsonl")
+    return args
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+    if not OPENAI_API_KEY:
+        print("Ошибка: задайте OPENAI_API_KEY в .env или в переменных окружения.", file=sys.stderr)
+        sys.exit(1)
+    if not args.input.exists():
+        print(f"Ошибка: файл {args.input} не найден.", file=sys.stderr)
+        sys.exit(1)
+    logging.basicConfig(level=logging.WARNING, format="  %(levelname)s %(name)s: %(message)s")
+    try:
+        runner = asyncio.run(
+            run_batch(args.input, args.output, model=args.model, concurrency=args.concurrency)
+        )
+    except KeyboardInterrupt:
+        print(f"  Прервано. Готовые ответы — в {args.output}; повторный запуск продолжит с места остановки.")
+        sys.exit(130)
+    print(f"  Результаты — в {args.output}\n")
+    if runner.stats["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
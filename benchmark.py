@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+"""
+Офлайн-нагрузочный тест бота без реальных OpenAI и Telegram.
+
+В отдельном процессе поднимается заглушка Chat Completions (задержка до первого байта,
+потоковая выдача по фрагментам, поле usage, доля ответов 429), клиент OpenAI направляется
+на неё через OPENAI_BASE_URL. Обработчики бота (handle_text, cmd_stats, cmd_clear) получают
+синтетические обновления через диспетчер; запросы к Telegram перехватывает фальшивая сессия
+aiogram. Базы SQLite создаются во временном каталоге.
+
+Отчёт: p50/p95/p99 полной обработки обновления по типам, сообщений в секунду, рост RSS,
+скорость записи в SQLite. Результат можно сохранить (--json) и сравнить с прошлым
+прогоном (--compare), чтобы ловить регрессии в context_manager и openai_client.
+
+Примеры:
+    python benchmark.py --users 2000 --messages 5 --json before.json
+    python benchmark.py --users 2000 --messages 5 --compare before.json
+    python benchmark.py --serve-openai --port 8765   # только заглушка OpenAI
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from collections.abc import AsyncGenerator
+from pathlib import Path
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, SendMessage
+from aiohttp import web
+
+# Метрики для сравнения прогонов: имя → True, если больше — лучше
+COMPARED_METRICS: dict[str, bool] = {
+    "messages_per_sec": True,
+    "latency.text.p50": False,
+    "latency.text.p95": False,
+    "latency.text.p99": False,
+    "latency.stats.p95": False,
+    "latency.clear.p95": False,
+    "rss_growth_mb": False,
+    "sqlite_rows_per_sec": True,
+}
+
+# Лимиты флуда Telegram, которые без --telegram-limits поднимаются так, что не срабатывают
+TELEGRAM_RATE_SETTINGS = ("TELEGRAM_GLOBAL_RATE", "TELEGRAM_CHAT_RATE", "TELEGRAM_CHAT_BURST", "TELEGRAM_GROUP_RATE")
+UNTHROTTLED_RATE = "1000000"
+
+FILLER_WORDS = (
+    "контекст", "модель", "ответ", "запрос", "токен", "бот", "история", "очередь",
+    "сообщение", "пользователь", "задача", "пример", "данные", "время", "память",
+)
+
+
+# --- Заглушка OpenAI ---
+
+
+def _fake_tokens(messages: list[dict[str, Any]]) -> int:
+    return sum(len(str(message.get("content", ""))) // 4 + 4 for message in messages)
+
+
+def create_fake_openai_app(
+    *,
+    latency: float,
+    chunk_delay: float,
+    chunks: int,
+    error_rate: float,
+    slow_rate: float = 0.0,
+    slow_latency: float = 0.0,
+) -> web.Application:
+    """
+    aiohttp-приложение с POST /v1/chat/completions.
+
+    Args:
+        latency: Задержка до первого байта ответа, сек.
+        chunk_delay: Пауза между фрагментами потокового ответа, сек.
+        chunks: Число фрагментов (слов) в ответе.
+        error_rate: Доля запросов, на которые отвечается 429.
+        slow_rate: Доля «зависающих» запросов — их задержка slow_latency вместо latency.
+        slow_latency: Задержка до первого байта у медленных запросов, сек.
+    """
+    counter = itertools.count(1)
+
+    async def completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        number = next(counter)
+        if error_rate and random.random() < error_rate:
+            return web.json_response(
+                {
+                    "error": {
+                        "message": "Rate limit reached (fake)",
+                        "type": "requests",
+                        "code": "rate_limit_exceeded",
+                    }
+                },
+                status=429,
+                headers={"retry-after": "0.1"},
+            )
+        await asyncio.sleep(slow_latency if slow_rate and random.random() < slow_rate else latency)
+        model = body.get("model", "fake")
+        words = [random.choice(FILLER_WORDS) for _ in range(chunks)]
+        prompt_tokens = _fake_tokens(body.get("messages", []))
+        # Как у OpenAI: префикс от 1024 токенов кэшируется кратно 128
+        cached_tokens = prompt_tokens // 128 * 128 if prompt_tokens >= 1024 else 0
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": chunks,
+            "total_tokens": prompt_tokens + chunks,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            "completion_tokens_details": {"reasoning_tokens": 0},
+        }
+        base = {"id": f"chatcmpl-fake-{number}", "created": int(time.time()), "model": model}
+
+        if not body.get("stream"):
+            return web.json_response(
+                {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": " ".join(words)},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(payload: dict[str, Any]) -> None:
+            data = {**base, "object": "chat.completion.chunk", **payload}
+            await response.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+
+        for index, word in enumerate(words):
+            if index and chunk_delay:
+                await asyncio.sleep(chunk_delay)
+            delta = {"content": word if index == 0 else " " + word}
+            if index == 0:
+                delta["role"] = "assistant"
+            await send({"choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        await send({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send({"choices": [], "usage": usage})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    return app
+
+
+def serve_fake_openai(port: int, options: dict[str, Any]) -> None:
+    """Запускает заглушку OpenAI (точка входа дочернего процесса)."""
+    logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+    web.run_app(create_fake_openai_app(**options), host="127.0.0.1", port=port, print=None)
+
+
+# --- Фальшивый Telegram ---
+
+
+class FakeTelegramSession(BaseSession):
+    """Сессия aiogram, которая отвечает на методы Bot API локально, без сети."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot: Bot, method: Any, timeout: int | None = None) -> Any:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls[method.__api_method__] += 1
+        if isinstance(method, SendMessage):
+            message_id = next(self._message_ids)
+        elif isinstance(method, EditMessageText):
+            message_id = method.message_id
+        else:
+            return self.check_response(bot, method, 200, '{"ok": true, "result": true}').result
+        result = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": method.chat_id, "type": "private"},
+            "text": method.text,
+        }
+        content = json.dumps({"ok": True, "result": result}, ensure_ascii=False)
+        return self.check_response(bot, method, 200, content).result
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: dict[str, Any] | None = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        """Файлы в бенчмарке не скачиваются — пустой поток."""
+        for chunk in ():
+            yield chunk
+
+    async def close(self) -> None:
+        pass
+
+
+def _update(update_id: int, user_id: int, text: str) -> dict[str, Any]:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        },
+    }
+
+
+# --- Замеры ---
+
+
+def _rss_mb() -> float:
+    """Текущий RSS процесса, МБ (/proc; без него — пиковый RSS из getrusage)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "p50": rank(0.50),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "max": ordered[-1],
+    }
+
+
+def _count_rows(db_path: Path, table: str) -> int:
+    if not db_path.exists():
+        return 0
+    conn = sqlite3.connect(str(db_path))
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
+
+# --- Прогон ---
+
+
+async def run_benchmark(args: argparse.Namespace, db_dir: Path) -> dict[str, Any]:
+    # Настройки читаются при импорте config — модули бота импортируются после подмены окружения
+    import bot as bot_module
+    from context_manager import get_context_stats, get_usage_writer_stats, init_token_usage_db
+    from openai_client import get_hedge_stats
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        # Повторы после внедрённых 429 ожидаемы — в отчёте они видны по задержкам
+        logging.getLogger("openai_client").setLevel(logging.ERROR)
+
+    session = FakeTelegramSession(args.telegram_latency)
+    fake_bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    # Планировщик исходящих запросов бота; без --telegram-limits его лимиты не сдерживают
+    # прогон, иначе отчёт мерил бы ожидание лимитов флуда, а не обработку сообщений
+    fake_bot.session.middleware(bot_module.sender)
+    dp = bot_module.dp
+
+    init_token_usage_db()
+    await dp.emit_startup(bot=fake_bot)
+
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: Counter[str] = Counter()
+    update_ids = itertools.count(1)
+    rng = random.Random(args.seed)
+    rss_start = _rss_mb()
+    rss_peak = rss_start
+    running = True
+
+    async def sample_rss() -> None:
+        nonlocal rss_peak
+        while running:
+            rss_peak = max(rss_peak, _rss_mb())
+            await asyncio.sleep(0.5)
+
+    def next_command(user_id: int, index: int) -> tuple[str, str]:
+        roll = rng.random()
+        if roll < args.stats_ratio:
+            return "stats", "/stats"
+        if roll < args.stats_ratio + args.clear_ratio:
+            return "clear", "/clear"
+        words = " ".join(rng.choice(FILLER_WORDS) for _ in range(args.words))
+        return "text", f"Сообщение {index} от {user_id}: {words}"
+
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def simulate_user(user_id: int) -> None:
+        async with limit:
+            for index in range(args.messages):
+                kind, text = next_command(user_id, index)
+                started = time.perf_counter()
+                try:
+                    await dp.feed_raw_update(fake_bot, _update(next(update_ids), user_id, text))
+                except Exception as e:
+                    errors[type(e).__name__] += 1
+                latencies[kind].append(time.perf_counter() - started)
+                if args.think_time:
+                    await asyncio.sleep(rng.uniform(0, args.think_time))
+
+    sampler = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(user_id) for user_id in range(1, args.users + 1)))
+    duration = time.perf_counter() - started
+    running = False
+    await sampler
+
+    context_stats = get_context_stats()
+    writer_stats = get_usage_writer_stats()
+    rss_end = _rss_mb()
+    await dp.emit_shutdown(bot=fake_bot)
+
+    usage_rows = _count_rows(db_dir / "token_usage.db", "token_usage")
+    context_rows = int(context_stats.get("rows_written", 0))
+    messages = sum(len(values) for values in latencies.values())
+    return {
+        "params": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("json", "compare", "serve_openai", "verbose")
+        },
+        "duration_sec": duration,
+        "messages": messages,
+        "messages_per_sec": messages / duration if duration else 0.0,
+        "errors": dict(errors),
+        "latency": {kind: _percentiles(values) for kind, values in sorted(latencies.items())},
+        "rss_start_mb": rss_start,
+        "rss_peak_mb": max(rss_peak, rss_end),
+        "rss_end_mb": rss_end,
+        "rss_growth_mb": rss_end - rss_start,
+        "sqlite_usage_rows": usage_rows,
+        "sqlite_context_rows": context_rows,
+        "sqlite_rows_per_sec": (usage_rows + context_rows) / duration if duration else 0.0,
+        "usage_flushes": writer_stats.get("flushes", 0),
+        "telegram_calls": dict(session.calls),
+        "hedge": get_hedge_stats(),
+    }
+
+
+def _metric(results: dict[str, Any], name: str) -> float | None:
+    value: Any = results
+    for part in name.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return float(value)
+
+
+def print_report(results: dict[str, Any]) -> None:
+    print(f"\n  Сообщений: {results['messages']} за {results['duration_sec']:.2f} с "
+          f"({results['messages_per_sec']:.1f} сообщений/с)")
+    if results["errors"]:
+        print(f"  Ошибки: {results['errors']}")
+    print("\n  Задержка обработки обновления, мс:")
+    print(f"    {'тип':<8}{'кол-во':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for kind, stats in results["latency"].items():
+        print(
+            f"    {kind:<8}{stats['count']:>8}"
+            + "".join(f"{stats[key] * 1000:>10.1f}" for key in ("p50", "p95", "p99", "max"))
+        )
+    print(
+        f"\n  RSS: {results['rss_start_mb']:.1f} → {results['rss_end_mb']:.1f} МБ "
+        f"(пик {results['rss_peak_mb']:.1f}, рост {results['rss_growth_mb']:+.1f})"
+    )
+    print(
+        f"  SQLite: token_usage {results['sqlite_usage_rows']} строк "
+        f"({results['usage_flushes']} пакетов), контексты {results['sqlite_context_rows']} строк, "
+        f"{results['sqlite_rows_per_sec']:.1f} строк/с"
+    )
+    print(f"  Вызовы Telegram: {results['telegram_calls']}")
+    for key, hedge in results.get("hedge", {}).items():
+        print(
+            f"  OpenAI {key}: дублей {hedge['hedged']} из {hedge['requests']} "
+            f"({hedge['hedge_rate']:.1%}, быстрее основного {hedge['hedge_wins']}), порог "
+            f"{hedge['threshold']:.2f} с, p99 {hedge['p99_primary']:.2f} → {hedge['p99_effective']:.2f} с "
+            f"({-hedge['p99_improvement']:+.0%})"
+        )
+    print()
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], threshold: float) -> bool:
+    """Печатает сравнение с прошлым прогоном; True, если есть регрессия больше threshold %."""
+    regressed = False
+    print(f"  Сравнение с прошлым прогоном (порог {threshold:.0f}%):")
+    for name, higher_is_better in COMPARED_METRICS.items():
+        current, before = _metric(results, name), _metric(baseline, name)
+        if current is None or before is None:
+            continue
+        change = (current - before) / before * 100 if before else 0.0
+        worse = -change if higher_is_better else change
+        mark = ""
+        if worse > threshold:
+            mark = "  ⚠ регрессия"
+            regressed = True
+        print(f"    {name:<22}{before:>12.4f} → {current:<12.4f}{change:+7.1f}%{mark}")
+    print()
+    return regressed
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Офлайн-нагрузочный тест бота")
+    load = parser.add_argument_group("нагрузка")
+    load.add_argument("--users", type=int, default=1000, help="число пользователей")
+    load.add_argument("--messages", type=int, default=5, help="сообщений на пользователя")
+    load.add_argument("--concurrency", type=int, default=200, help="одновременно активных пользователей")
+    load.add_argument("--stats-ratio", type=float, default=0.05, help="доля команд /stats")
+    load.add_argument("--clear-ratio", type=float, default=0.02, help="доля команд /clear")
+    load.add_argument("--words", type=int, default=30, help="слов в текстовом сообщении")
+    load.add_argument("--think-time", type=float, default=0.0, help="пауза пользователя между сообщениями, сек (до)")
+    load.add_argument("--seed", type=int, default=1)
+    stub = parser.add_argument_group("заглушки")
+    stub.add_argument("--latency", type=float, default=0.2, help="задержка OpenAI до первого байта, сек")
+    stub.add_argument("--chunk-delay", type=float, default=0.01, help="пауза между фрагментами потока, сек")
+    stub.add_argument("--chunks", type=int, default=40, help="фрагментов (токенов) в ответе")
+    stub.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    stub.add_argument("--slow-rate", type=float, default=0.0, help="доля медленных ответов (хвост задержек)")
+    stub.add_argument("--slow-latency", type=float, default=5.0, help="задержка медленных ответов, сек")
+    stub.add_argument("--telegram-latency", type=float, default=0.0, help="задержка каждого вызова Bot API, сек")
+    stub.add_argument(
+        "--telegram-limits",
+        action="store_true",
+        help="включить лимиты флуда Telegram (TELEGRAM_* из окружения); по умолчанию без ограничений",
+    )
+    stub.add_argument("--port", type=int, default=8765, help="порт заглушки OpenAI")
+    stub.add_argument("--serve-openai", action="store_true", help="только запустить заглушку OpenAI")
+    out = parser.add_argument_group("вывод")
+    out.add_argument("--json", type=Path, help="сохранить результаты в файл")
+    out.add_argument("--compare", type=Path, help="сравнить с результатами прошлого прогона")
+    out.add_argument("--threshold", type=float, default=10.0, help="порог регрессии, %%")
+    out.add_argument("--verbose", action="store_true", help="не приглушать логи бота")
+    return parser.parse_args()
+
+
+def _wait_for_port(port: int, timeout: float = 30.0) -> None:
+    """Ждёт, пока заглушка начнёт принимать соединения."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Заглушка OpenAI не запустилась на порту {port}")
+            time.sleep(0.1)
+
+
+def main() -> None:
+    args = parse_args()
+    stub_options = {
+        "latency": args.latency,
+        "chunk_delay": args.chunk_delay,
+        "chunks": args.chunks,
+        "error_rate": args.error_rate,
+        "slow_rate": args.slow_rate,
+        "slow_latency": args.slow_latency,
+    }
+    if args.serve_openai:
+        print(f"Заглушка OpenAI: http://127.0.0.1:{args.port}/v1")
+        serve_fake_openai(args.port, stub_options)
+        return
+
+    stub = multiprocessing.get_context("spawn").Process(
+        target=serve_fake_openai, args=(args.port, stub_options), daemon=True
+    )
+    stub.start()
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as tmp:
+        db_dir = Path(tmp)
+        os.environ.update(
+            {
+                "OPENAI_BASE_URL": f"http://127.0.0.1:{args.port}/v1",
+                "OPENAI_API_KEY": "benchmark",
+                "BOT_TOKEN": "123456:benchmark",
+                "TOKEN_USAGE_DB_PATH": str(db_dir / "token_usage.db"),
+                "CONTEXT_DB_PATH": str(db_dir / "contexts.db"),
+                "RESPONSE_CACHE_DB_PATH": str(db_dir / "response_cache.db"),
+            }
+        )
+        if not args.telegram_limits:
+            os.environ.update({name: UNTHROTTLED_RATE for name in TELEGRAM_RATE_SETTINGS})
+        try:
+            _wait_for_port(args.port)
+            results = asyncio.run(run_benchmark(args, db_dir))
+        finally:
+            stub.terminate()
+            stub.join()
+
+    print_report(results)
+    if args.json:
+        args.json.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"  Результаты сохранены в {args.json}\n")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
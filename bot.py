@@ -1,25 +1,85 @@
 """
 Telegram-бот с OpenAI (gpt-5-mini). Контекст в памяти, учёт токенов в SQLite.
+
+Обновления приходят через long polling или вебхук (BOT_MODE=webhook) на встроенный
+aiohttp-сервер. Этапы обработки сообщения замеряются в реестр metrics: он отдаётся
+в формате Prometheus на METRICS_PORT и сводкой по команде /perf (для ADMIN_USER_IDS).
 """
 
 import asyncio
 import logging
+import os
 import sys
+import time
 
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
-from config import BOT_OPENAI_MODEL, BOT_TOKEN, OPENAI_API_KEY
+from config import (
+    ADMIN_USER_IDS,
+    BOT_MODE,
+    BOT_MODEL_TIERS,
+    BOT_STREAM_EDIT_INTERVAL,
+    BOT_STREAM_EDIT_MIN_CHARS,
+    BOT_SYSTEM_PROMPT,
+    BOT_TOKEN,
+    METRICS_HOST,
+    METRICS_PORT,
+    OPENAI_API_KEY,
+    OPENAI_MAX_CONCURRENCY,
+    ROUTER_HEALTH_WINDOW,
+    ROUTER_MAX_ERROR_RATE,
+    ROUTER_MAX_LATENCY,
+    ROUTER_MIN_SAMPLES,
+    SCHEDULER_MAX_PENDING,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_GROUP_RATE,
+    TELEGRAM_MAX_RETRIES,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
 from context_manager import (
+    USAGE_CACHE,
+    USAGE_CHAT,
     append_to_context,
+    build_prompt,
+    cancel_summaries,
     clear_context,
-    get_messages,
+    close_context_backend,
+    get_context_stats,
+    get_context_tokens,
+    get_usage_writer_stats,
     get_user_token_stats,
     init_token_usage_db,
-    log_token_usage,
+    log_response_usage,
+    run_context_sweeper,
+    schedule_summary,
+    start_context_backend,
+    start_usage_writer,
+    stop_usage_writer,
+)
+from metrics import registry
+from openai_client import (
+    close_async_client,
+    get_hedge_stats,
+    get_response_cache_stats,
+    init_async_client,
+    set_rate_limit_share,
 )
-from openai_client import get_chat_response
+from pricing import format_price, model_prices, usage_cost
+from router import ModelRouter, RoutedStream, parse_tiers
+from scheduler import RequestScheduler, SchedulerBusy
+from telegram_sender import TelegramSender, split_message
+from tokenizer import count_tokens
 
 logging.basicConfig(
     level=logging.INFO,
@@ -30,17 +90,147 @@ logger = logging.getLogger(__name__)
 
 CLEAR_PHRASES = ("очистить контекст", "очистить", "clear context", "clear")
 
-# Стоимость токенов: запросы $0.25 / 1M, ответы $2 / 1M
-PROMPT_COST_PER_1M = 0.25
-COMPLETION_COST_PER_1M = 2.0
+MAX_MESSAGE_LENGTH = 4000
 
+# Окна /stats: аргумент команды → (дней, подпись)
+STATS_WINDOWS: dict[str, tuple[int, str]] = {
+    "today": (1, "за сегодня"),
+    "сегодня": (1, "за сегодня"),
+    "7": (7, "за 7 дней"),
+    "week": (7, "за 7 дней"),
+    "неделя": (7, "за 7 дней"),
+    "30": (30, "за 30 дней"),
+    "month": (30, "за 30 дней"),
+    "месяц": (30, "за 30 дней"),
+}
+
+# Все исходящие запросы бота проходят через лимиты флуда Telegram
+sender = TelegramSender(
+    global_rate=TELEGRAM_GLOBAL_RATE,
+    chat_rate=TELEGRAM_CHAT_RATE,
+    chat_burst=TELEGRAM_CHAT_BURST,
+    group_rate=TELEGRAM_GROUP_RATE,
+    max_retries=TELEGRAM_MAX_RETRIES,
+)
 bot = Bot(token=BOT_TOKEN)
+bot.session.middleware(sender)
 dp = Dispatcher()
+scheduler = RequestScheduler(
+    max_concurrency=OPENAI_MAX_CONCURRENCY,
+    max_pending=SCHEDULER_MAX_PENDING,
+)
+router = ModelRouter(
+    parse_tiers(BOT_MODEL_TIERS),
+    health_window=ROUTER_HEALTH_WINDOW,
+    max_error_rate=ROUTER_MAX_ERROR_RATE,
+    max_latency=ROUTER_MAX_LATENCY,
+    min_samples=ROUTER_MIN_SAMPLES,
+)
+
+# Этапы обработки сообщения в порядке вывода в /perf
+STAGES = (
+    "context_fetch",
+    "queue_wait",
+    "openai_ttfb",
+    "openai_total",
+    "usage_write",
+    "telegram_send",
+    "total",
+)
+STAGE_SECONDS = registry.histogram(
+    "bot_stage_seconds", "Длительность этапов обработки сообщения, сек", ("stage",)
+)
+REQUESTS = registry.counter("bot_requests_total", "Сообщения к модели по исходу", ("outcome",))
+ERRORS = registry.counter("bot_errors_total", "Ошибки обработки сообщений по типу", ("type",))
+TELEGRAM_ERRORS = registry.counter(
+    "bot_telegram_errors_total", "Ошибки промежуточных правок ответа в Telegram по типу", ("type",)
+)
+TOKENS = registry.counter("bot_tokens_total", "Токены модели", ("kind",))
+COST = registry.counter("bot_cost_usd_total", "Ориентировочная стоимость ответов, $")
+MODEL_REQUESTS = registry.counter("bot_model_requests_total", "Ответы по моделям", ("model",))
+FAILOVERS = registry.counter("bot_model_failovers_total", "Переключения на другую модель после сбоя")
+registry.gauge("bot_scheduler_active", "Запросов к модели в работе", lambda: scheduler.stats()["active"])
+registry.gauge("bot_scheduler_pending", "Запросов в очереди планировщика", lambda: scheduler.stats()["pending"])
+registry.gauge("bot_context_users", "Контекстов пользователей в памяти", lambda: get_context_stats()["users"])
+registry.gauge(
+    "bot_usage_queue_depth",
+    "Строк token_usage в очереди записи",
+    lambda: get_usage_writer_stats().get("queue_depth", 0),
+)
+registry.gauge(
+    "bot_response_cache_hit_ratio",
+    "Доля попаданий в кэш ответов",
+    lambda: get_response_cache_stats().get("hit_ratio", 0.0),
+)
+
+
+def _fit_message(text: str) -> str:
+    """Обрезает текст до лимита сообщения Telegram (для промежуточного показа ответа)."""
+    if len(text) > MAX_MESSAGE_LENGTH:
+        return text[: MAX_MESSAGE_LENGTH - 1] + "…"
+    return text
+
+
+class StreamingReply:
+    """
+    Постепенно дописывает ответ в сообщение-заглушку по мере прихода текста.
 
+    Правки объединяются: не чаще BOT_STREAM_EDIT_INTERVAL секунд и не менее
+    BOT_STREAM_EDIT_MIN_CHARS новых символов; промежуточная правка пропускается и тогда,
+    когда в чат сейчас нельзя отправить без ожидания (лимиты TelegramSender).
+    Первый фрагмент показывается сразу. Длинный ответ в конце делится на несколько
+    сообщений: первое заменяет заглушку, остальные отправляются следом.
+    """
 
-def _call_openai(messages: list[dict[str, str]]) -> tuple[str, dict[str, int] | None]:
-    """Синхронный вызов OpenAI (для run_in_executor). Без temperature/max_tokens — для рассуждающих моделей."""
-    return get_chat_response(messages, BOT_OPENAI_MODEL)
+    def __init__(self, placeholder: Message) -> None:
+        self._message = placeholder
+        self._shown = ""
+        self._next_edit_at = 0.0
+        # Сколько времени ушло на правки и отправки (для этапа telegram_send)
+        self.send_seconds = 0.0
+
+    async def update(self, stream: RoutedStream) -> None:
+        """
+        Промежуточная правка; пропускается, если бюджет по времени/объёму не набран.
+        Текст потока склеивается только для правки — проверки идут по его длине.
+        """
+        if time.monotonic() < self._next_edit_at:
+            return
+        if self._shown and stream.content_length - len(self._shown) < BOT_STREAM_EDIT_MIN_CHARS:
+            return
+        if not sender.ready(self._message.chat.id):
+            return
+        try:
+            await self._edit(_fit_message(stream.content))
+        except TelegramAPIError as e:
+            # Правка необязательна: полный ответ всё равно уйдёт в finish(). Ошибка Telegram
+            # не прерывает поток и не считается ошибкой модели
+            logger.warning("Не удалось показать часть ответа: %s", e)
+            TELEGRAM_ERRORS.inc(type(e).__name__)
+            self._next_edit_at = time.monotonic() + BOT_STREAM_EDIT_INTERVAL
+
+    async def finish(self, text: str) -> None:
+        """Полный ответ без обрезки: при необходимости — несколькими сообщениями."""
+        parts = split_message(text, MAX_MESSAGE_LENGTH)
+        await self._edit(parts[0] if parts else "")
+        for part in parts[1:]:
+            started = time.perf_counter()
+            await self._message.answer(part)
+            self.send_seconds += time.perf_counter() - started
+
+    async def _edit(self, text: str) -> None:
+        text = text or "…"
+        if text == self._shown:
+            return
+        started = time.perf_counter()
+        try:
+            await self._message.edit_text(text)
+        except TelegramBadRequest as e:
+            # Например, «message is not modified» — ответ от этого не теряется
+            logger.warning("Не удалось обновить сообщение: %s", e)
+        self.send_seconds += time.perf_counter() - started
+        self._shown = text
+        self._next_edit_at = time.monotonic() + BOT_STREAM_EDIT_INTERVAL
 
 
 @dp.message(Command("start"))
@@ -48,31 +238,117 @@ async def cmd_start(message: Message) -> None:
     await message.answer(
         "Привет! Я бот с GPT. Пиши сообщения — я буду отвечать с учётом контекста.\n"
         "/clear или «очистить контекст» — сбросить историю.\n"
-        "/stats — статистика токенов и стоимость."
+        "/stats — статистика токенов и стоимость (/stats today, /stats 7, /stats 30 — за период)."
     )
 
 
 @dp.message(Command("stats"))
-async def cmd_stats(message: Message) -> None:
-    """Статистика токенов и стоимость в долларах."""
+async def cmd_stats(message: Message, command: CommandObject) -> None:
+    """Статистика токенов и стоимость в долларах (аргумент — период: today, 7, 30)."""
     user_id = message.from_user.id if message.from_user else 0
-    prompt_tokens, completion_tokens = get_user_token_stats(user_id)
-    cost_prompt = (prompt_tokens / 1_000_000) * PROMPT_COST_PER_1M
-    cost_completion = (completion_tokens / 1_000_000) * COMPLETION_COST_PER_1M
-    total_cost = cost_prompt + cost_completion
+    days, label = STATS_WINDOWS.get((command.args or "").strip().lower(), (None, "за всё время"))
+    by_model = get_user_token_stats(user_id, days)
+    prompt_tokens = sum(stats[0] for stats in by_model.values())
+    completion_tokens = sum(stats[1] for stats in by_model.values())
+    cached_tokens = sum(stats[2] for stats in by_model.values())
+    reasoning_tokens = sum(stats[3] for stats in by_model.values())
+    cost_prompt = cost_cached = cost_completion = saved = 0.0
+    model_lines = []
+    for model, (prompt, completion, cached, _) in sorted(by_model.items()):
+        prompt_price, cached_price, completion_price = model_prices(model)
+        costs = usage_cost(model, prompt, completion, cached)
+        cost_prompt += costs[0]
+        cost_cached += costs[1]
+        cost_completion += costs[2]
+        # Сколько стоили бы кэшированные токены по обычной цене запросов этой модели
+        saved += cached / 1_000_000 * prompt_price - costs[1]
+        model_lines.append(
+            f"{model or 'до учёта моделей'}: {prompt + completion:,} токенов, <b>${sum(costs):.6f}</b> "
+            f"({format_price(prompt_price)} / {format_price(cached_price)} / {format_price(completion_price)})"
+        )
+    total_cost = cost_prompt + cost_cached + cost_completion
+    hit_ratio = cached_tokens / prompt_tokens if prompt_tokens else 0.0
     text = (
-        "📊 <b>Статистика токенов</b>\n\n"
+        f"📊 <b>Статистика токенов</b> ({label})\n\n"
         f"Токенов запросов: <b>{prompt_tokens:,}</b>\n"
+        f"  из кэша: <b>{cached_tokens:,}</b> ({hit_ratio:.0%})\n"
         f"Токенов ответов: <b>{completion_tokens:,}</b>\n"
+        f"  на рассуждения: <b>{reasoning_tokens:,}</b>\n"
         f"Всего токенов: <b>{prompt_tokens + completion_tokens:,}</b>\n\n"
         "💰 <b>Стоимость</b>\n"
-        f"Запросы ($0.25/1M): <b>${cost_prompt:.6f}</b>\n"
-        f"Ответы ($2/1M): <b>${cost_completion:.6f}</b>\n"
-        f"Итого: <b>${total_cost:.6f}</b>"
+        f"Запросы: <b>${cost_prompt:.6f}</b>\n"
+        f"Запросы из кэша: <b>${cost_cached:.6f}</b>\n"
+        f"Ответы: <b>${cost_completion:.6f}</b>\n"
+        f"Итого: <b>${total_cost:.6f}</b> (экономия на кэше ${saved:.6f})"
     )
+    if model_lines:
+        # Тарифы: запросы / из кэша / ответы
+        text += "\n\n🤖 <b>По моделям</b>\n" + "\n".join(model_lines)
     await message.answer(text, parse_mode="HTML")
 
 
+def _format_perf() -> str:
+    """Сводка метрик процесса для /perf."""
+    lines = [f"⏱ <b>Производительность</b> (pid {os.getpid()})\n", "Этап: p50 / p95 / среднее, мс (кол-во)"]
+    for stage in STAGES:
+        if STAGE_SECONDS.count(stage):
+            lines.append(
+                f"{stage}: {STAGE_SECONDS.quantile(0.5, stage) * 1000:.1f} / "
+                f"{STAGE_SECONDS.quantile(0.95, stage) * 1000:.1f} / "
+                f"{STAGE_SECONDS.mean(stage) * 1000:.1f} ({STAGE_SECONDS.count(stage)})"
+            )
+    outcomes = ", ".join(f"{labels[0]} {value:.0f}" for labels, value in sorted(REQUESTS.values().items()))
+    lines.append(f"\nЗапросы: {outcomes or 'нет'}")
+    errors = ", ".join(f"{labels[0]} {value:.0f}" for labels, value in sorted(ERRORS.values().items()))
+    if errors:
+        lines.append(f"Ошибки: {errors}")
+    telegram_errors = ", ".join(
+        f"{labels[0]} {value:.0f}" for labels, value in sorted(TELEGRAM_ERRORS.values().items())
+    )
+    if telegram_errors:
+        lines.append(f"Ошибки правок в Telegram: {telegram_errors}")
+    lines.append(
+        f"Токены: запросы {TOKENS.value('prompt'):,.0f} (из кэша {TOKENS.value('cached'):,.0f}), "
+        f"ответы {TOKENS.value('completion'):,.0f}, дубли {TOKENS.value('hedge'):,.0f}; "
+        f"стоимость ${COST.value():.4f}"
+    )
+    queue = scheduler.stats()
+    lines.append(
+        f"Планировщик: в работе {queue['active']}, в очереди {queue['pending']}, "
+        f"отклонено {queue['rejected']}"
+    )
+    for key, hedge in get_hedge_stats().items():
+        if hedge["hedged"]:
+            lines.append(
+                f"Хеджирование {key}: {hedge['hedge_rate']:.1%} запросов "
+                f"(дубль быстрее в {hedge['hedge_wins']:.0f}), p99 {hedge['p99_primary']:.2f} → "
+                f"{hedge['p99_effective']:.2f} с"
+            )
+    for model, health in router.stats().items():
+        if health["routed"] or health["window_requests"]:
+            lines.append(
+                f"Модель {model}: ответов {health['routed']:.0f}, переключений с неё "
+                f"{health['failovers']:.0f}; за окно ошибок {health['error_rate']:.0%}, "
+                f"p90 первого фрагмента {health['p90_latency']:.2f} с"
+                + (" — деградировала" if health["degraded"] else "")
+            )
+    outbound = sender.stats()
+    lines.append(
+        f"Telegram: отправлено {outbound['sent']}, отложено {outbound['delayed']} "
+        f"({outbound['wait_seconds']:.1f} с), RetryAfter {outbound['retry_after']}"
+    )
+    return "\n".join(lines)
+
+
+@dp.message(Command("perf"))
+async def cmd_perf(message: Message) -> None:
+    """Сводка метрик процесса (только для ADMIN_USER_IDS)."""
+    if not message.from_user or message.from_user.id not in ADMIN_USER_IDS:
+        await message.answer("Команда доступна только администраторам.")
+        return
+    await message.answer(_format_perf(), parse_mode="HTML")
+
+
 @dp.message(Command("clear"))
 async def cmd_clear(message: Message) -> None:
     user_id = message.from_user.id if message.from_user else 0
@@ -93,32 +369,222 @@ async def handle_text(message: Message) -> None:
         await message.answer("Контекст диалога очищен. Можете начать разговор заново.")
         return
 
-    messages = get_messages(user_id) + [{"role": "user", "content": text}]
-
-    await message.answer("Думаю…")
-    loop = asyncio.get_event_loop()
+    # Место в очереди пользователя — до первого await, иначе конкурентные задачи aiogram
+    # могут встать в очередь не в порядке сообщений
     try:
-        content, usage = await loop.run_in_executor(None, _call_openai, messages)
-    except Exception as e:
-        logger.exception("OpenAI error for user %s: %s", user_id, e)
-        await message.answer(
-            "Произошла ошибка при обращении к модели. Попробуйте позже или упростите запрос."
-        )
+        ticket = scheduler.reserve(user_id)
+    except SchedulerBusy:
+        REQUESTS.inc("busy")
+        ERRORS.inc("SchedulerBusy")
+        await message.answer("Сейчас слишком много запросов. Попробуйте через минуту.")
         return
+    received = time.perf_counter()
+    try:
+        placeholder = await message.answer("Думаю…")
+    except BaseException:
+        scheduler.release(ticket)
+        raise
+    placeholder_seconds = time.perf_counter() - received
+    reply = StreamingReply(placeholder)
+    async with scheduler.slot(user_id, ticket=ticket) as queue_wait:
+        # Историю читаем уже в своей очереди — предыдущий ответ пользователя в ней есть
+        started = time.perf_counter()
+        # Уровень модели — по размеру сообщения вместе с историей
+        candidates = router.candidates(count_tokens(text) + get_context_tokens(user_id))
+        context_seconds = time.perf_counter() - started
+        # Неизменный system-промпт и дописываемая история — общий кэшируемый префикс;
+        # при переключении модели запрос собирается заново под её бюджет контекста.
+        # Без temperature/max_tokens — для рассуждающих моделей
+        stream = RoutedStream(
+            router,
+            candidates,
+            lambda model: build_prompt(user_id, text, model, system_prompt=BOT_SYSTEM_PROMPT),
+        )
+        started = time.perf_counter()
+        first_byte_seconds = None
+        try:
+            async for _ in stream:
+                if first_byte_seconds is None:
+                    first_byte_seconds = time.perf_counter() - started
+                await reply.update(stream)
+        except Exception as e:
+            logger.exception("OpenAI error for user %s (%s): %s", user_id, stream.model, e)
+            FAILOVERS.inc(amount=stream.failovers)
+            REQUESTS.inc("error")
+            ERRORS.inc(type(e).__name__)
+            await message.answer(
+                "Произошла ошибка при обращении к модели. Попробуйте позже или упростите запрос."
+            )
+            return
+        # Промежуточные правки сообщения относим к telegram_send, а не к модели
+        model_seconds = time.perf_counter() - started - reply.send_seconds
+        content, usage = stream.content, stream.usage
+        append_to_context(user_id, text, content)
+    logger.info(
+        "user_id=%s: модель %s, ожидание в очереди %.3f с, ответ модели %.3f с, "
+        "из кэша %s из %s токенов запроса",
+        user_id,
+        stream.model,
+        queue_wait,
+        model_seconds,
+        usage["cached_tokens"] if usage else 0,
+        usage["prompt_tokens"] if usage else 0,
+    )
+    schedule_summary(user_id)
 
-    append_to_context(user_id, text, content)
-
+    started = time.perf_counter()
     if usage:
-        log_token_usage(
+        log_response_usage(
             user_id,
-            usage["prompt_tokens"],
-            usage["completion_tokens"],
-            usage["total_tokens"],
+            usage,
+            category=USAGE_CACHE if usage.get("cache_hit") else USAGE_CHAT,
+            model=stream.model,
+        )
+    usage_seconds = time.perf_counter() - started
+
+    await reply.finish(content)
+    _record_request(
+        {
+            "context_fetch": context_seconds,
+            "queue_wait": queue_wait,
+            "openai_ttfb": first_byte_seconds or model_seconds,
+            "openai_total": model_seconds,
+            "usage_write": usage_seconds,
+            "telegram_send": placeholder_seconds + reply.send_seconds,
+            "total": time.perf_counter() - received,
+        },
+        stream.model,
+        usage,
+        failovers=stream.failovers,
+    )
+
+
+def _record_request(
+    stages: dict[str, float], model: str, usage: dict[str, int] | None, *, failovers: int = 0
+) -> None:
+    """Заносит этапы успешно обработанного сообщения, модель, токены и стоимость в реестр метрик."""
+    for stage, seconds in stages.items():
+        STAGE_SECONDS.observe(seconds, stage)
+    REQUESTS.inc("ok")
+    MODEL_REQUESTS.inc(model)
+    FAILOVERS.inc(amount=failovers)
+    if usage:
+        TOKENS.inc("prompt", amount=usage["prompt_tokens"])
+        TOKENS.inc("completion", amount=usage["completion_tokens"])
+        TOKENS.inc("cached", amount=usage["cached_tokens"])
+        TOKENS.inc("reasoning", amount=usage["reasoning_tokens"])
+        cost = sum(
+            usage_cost(model, usage["prompt_tokens"], usage["completion_tokens"], usage["cached_tokens"])
         )
+        if "hedge_prompt_tokens" in usage:
+            TOKENS.inc("hedge", amount=usage["hedge_prompt_tokens"] + usage["hedge_completion_tokens"])
+            cost += sum(usage_cost(model, usage["hedge_prompt_tokens"], usage["hedge_completion_tokens"]))
+        COST.inc(amount=cost)
+
+
+_background_tasks: list[asyncio.Task] = []
+_metrics_runner: web.AppRunner | None = None
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(
+        body=registry.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def start_metrics_server(port: int) -> None:
+    """Поднимает GET /metrics (формат Prometheus) на METRICS_HOST:port."""
+    global _metrics_runner
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    _metrics_runner = web.AppRunner(app, access_log=None)
+    await _metrics_runner.setup()
+    await web.TCPSite(_metrics_runner, METRICS_HOST, port).start()
+    logger.info("Метрики: http://%s:%s/metrics", METRICS_HOST, port)
+
 
-    if len(content) > 4000:
-        content = content[:3997] + "..."
-    await message.answer(content)
+async def stop_metrics_server() -> None:
+    global _metrics_runner
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+
+
+@dp.startup()
+async def on_startup(worker_index: int = 0) -> None:
+    """
+    Запуск общих ресурсов (в обоих режимах — polling и webhook).
+
+    Args:
+        worker_index: Номер воркера runner.py — сдвиг порта метрик, чтобы процессы не делили порт.
+    """
+    init_async_client()
+    await start_context_backend()
+    await start_usage_writer()
+    _background_tasks.append(asyncio.create_task(run_context_sweeper()))
+    if METRICS_PORT:
+        await start_metrics_server(METRICS_PORT + worker_index)
+
+
+@dp.shutdown()
+async def on_shutdown() -> None:
+    """Остановка: фоновые задачи, дозапись контекстов и token_usage, закрытие клиента."""
+    for task in _background_tasks:
+        task.cancel()
+    _background_tasks.clear()
+    await stop_metrics_server()
+    await cancel_summaries()
+    await close_context_backend()
+    await stop_usage_writer()
+    await close_async_client()
+
+
+def share_limits(workers: int) -> None:
+    """
+    Процесс — один из workers воркеров runner.py с общим токеном бота и ключом OpenAI:
+    общий лимит Telegram на бота и лимиты RPM/TPM делятся между воркерами поровну
+    (лимиты на чат не делятся — чат обслуживает один воркер).
+    """
+    sender.set_global_rate(TELEGRAM_GLOBAL_RATE / workers)
+    set_rate_limit_share(1 / workers)
+
+
+async def register_webhook() -> None:
+    """Регистрирует вебхук в Telegram, если задан WEBHOOK_URL (без него — локальная отладка)."""
+    if not WEBHOOK_URL:
+        return
+    url = WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+    await bot.set_webhook(url, secret_token=WEBHOOK_SECRET or None)
+    logger.info("Вебхук зарегистрирован: %s", url)
+
+
+async def run_webhook() -> None:
+    """
+    Принимает обновления на aiohttp-сервере WEBHOOK_HOST:WEBHOOK_PORT по пути WEBHOOK_PATH.
+
+    Проверяет заголовок X-Telegram-Bot-Api-Secret-Token (без WEBHOOK_SECRET — только при
+    локальной отладке без WEBHOOK_URL), сразу отвечает 200 и обрабатывает обновление
+    в фоновой задаче, чтобы долгий ответ модели не держал HTTP-запрос.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET or None,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info("Вебхук-сервер слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    await register_webhook()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
 async def main() -> None:
@@ -128,10 +594,16 @@ async def main() -> None:
     if not OPENAI_API_KEY:
         logger.error("OPENAI_API_KEY не задан. Укажите его в .env")
         sys.exit(1)
+    if BOT_MODE == "webhook" and WEBHOOK_URL and not WEBHOOK_SECRET:
+        logger.error("WEBHOOK_SECRET не задан: публичный вебхук принимал бы обновления от кого угодно")
+        sys.exit(1)
 
     init_token_usage_db()
-    logger.info("Бот запущен (модель: %s)", BOT_OPENAI_MODEL)
-    await dp.start_polling(bot)
+    logger.info("Бот запущен (модели: %s, режим: %s)", BOT_MODEL_TIERS, BOT_MODE)
+    if BOT_MODE == "webhook":
+        await run_webhook()
+    else:
+        await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+"""
+Сравнение вариантов в CLI: один промпт — несколько моделей и температур параллельно.
+
+    python main.py compare --models gpt-4.1,gpt-4.1-mini --temperatures 0,0.7,1.2
+
+Диалог тот же, что в main.py, но запрос уходит сразу всем вариантам (модели × температуры)
+через общий асинхронный клиент openai_client (ограничитель RPM/TPM, повторы, кэш ответов).
+Ответы печатаются по мере готовности с задержкой, токенами и стоимостью, в конце — сводная
+таблица; ожидание равно самому медленному варианту, а не сумме. Дозапросы продолжают
+диалог на выбранном варианте. Без --temperatures температура спрашивается как обычно.
+"""
+
+import argparse
+import asyncio
+import time
+
+from config import OPENAI_MODEL
+from main import TEMPERATURE_MAX, TEMPERATURE_MIN
+from openai_client import close_async_client, get_chat_response_async, init_async_client
+from pricing import usage_cost
+
+# Вариант запроса: (модель, температура)
+Variant = tuple[str, float]
+
+
+class VariantResult:
+    """Ответ варианта: текст и usage либо ошибка; latency — секунды от отправки до ответа."""
+
+    __slots__ = ("variant", "content", "usage", "latency", "error")
+
+    def __init__(
+        self,
+        variant: Variant,
+        latency: float,
+        *,
+        content: str = "",
+        usage: dict[str, int] | None = None,
+        error: str | None = None,
+    ) -> None:
+        self.variant = variant
+        self.latency = latency
+        self.content = content
+        self.usage = usage
+        self.error = error
+
+    def cost(self) -> float:
+        if not self.usage:
+            return 0.0
+        usage = self.usage
+        cost = sum(
+            usage_cost(self.variant[0], usage["prompt_tokens"], usage["completion_tokens"], usage["cached_tokens"])
+        )
+        if "hedge_prompt_tokens" in usage:
+            cost += sum(usage_cost(self.variant[0], usage["hedge_prompt_tokens"], usage["hedge_completion_tokens"]))
+        return cost
+
+
+def _describe(number: int, variant: Variant) -> str:
+    return f"[{number}] {variant[0]}, температура {variant[1]}"
+
+
+def print_variant(number: int, result: VariantResult) -> None:
+    """Ответ одного варианта — как только он готов."""
+    print(f"\n  ─── {_describe(number, result.variant)} — {result.latency:.2f} с ───\n")
+    if result.error:
+        print(f"  ⚠ Ошибка API: {result.error}")
+        return
+    print(result.content)
+    usage = result.usage
+    if usage and usage.get("cache_hit"):
+        print("\n    • Ответ из кэша, токены не потрачены")
+    elif usage:
+        print(
+            f"\n    • Токены: запрос {usage['prompt_tokens']} (из кэша {usage['cached_tokens']}), "
+            f"ответ {usage['completion_tokens']}; стоимость ${result.cost():.6f}"
+        )
+
+
+def print_comparison(results: list[VariantResult], elapsed: float) -> None:
+    """Сводная таблица вариантов и время всего сравнения против последовательных вызовов."""
+    sequential = sum(result.latency for result in results)
+    print(f"\n  ─── Сравнение: {elapsed:.2f} с (последовательно ≈ {sequential:.2f} с) ───")
+    print(f"    {'№':>2}  {'модель':<24} {'темп.':>5} {'задержка':>9} {'запрос':>7} {'ответ':>7} {'стоимость':>10}")
+    for number, result in enumerate(results, 1):
+        model, temperature = result.variant
+        if result.error:
+            print(f"    {number:>2}  {model:<24} {temperature:>5} {result.latency:>7.2f} с  ошибка")
+            continue
+        usage = result.usage or {}
+        print(
+            f"    {number:>2}  {model:<24} {temperature:>5} {result.latency:>7.2f} с "
+            f"{usage.get('prompt_tokens', 0):>7} {usage.get('completion_tokens', 0):>7} "
+            f"{f'${result.cost():.6f}':>10}"
+        )
+    print("  ─────────────────────────────────────────\n")
+
+
+async def _fan_out(
+    messages: list[dict[str, str]], variants: list[Variant], max_tokens: int
+) -> list[VariantResult]:
+    async def run(index: int, variant: Variant) -> tuple[int, VariantResult]:
+        started = time.perf_counter()
+        try:
+            content, usage = await get_chat_response_async(
+                messages, variant[0], temperature=variant[1], max_tokens=max_tokens
+            )
+        except Exception as e:
+            return index, VariantResult(variant, time.perf_counter() - started, error=f"{type(e).__name__}: {e}")
+        return index, VariantResult(variant, time.perf_counter() - started, content=content, usage=usage)
+
+    results: list[VariantResult | None] = [None] * len(variants)
+    init_async_client()
+    try:
+        for finished in asyncio.as_completed([run(index, variant) for index, variant in enumerate(variants)]):
+            index, result = await finished
+            results[index] = result
+            print_variant(index + 1, result)
+    finally:
+        await close_async_client()
+    return results
+
+
+def compare_variants(
+    messages: list[dict[str, str]], variants: list[Variant], max_tokens: int
+) -> list[VariantResult]:
+    """Отправляет messages всем вариантам одновременно; результаты — в порядке variants."""
+    print(f"\n  Отправляю запрос {len(variants)} вариантам...")
+    started = time.perf_counter()
+    results = asyncio.run(_fan_out(messages, variants, max_tokens))
+    print_comparison(results, time.perf_counter() - started)
+    return results
+
+
+def choose_variant(results: list[VariantResult]) -> VariantResult | None:
+    """Спрашивает, на каком варианте продолжить диалог (None — ни один не ответил)."""
+    answered = [number for number, result in enumerate(results, 1) if not result.error]
+    if not answered:
+        print("  Ни один вариант не ответил.\n")
+        return None
+    if len(answered) == 1:
+        chosen = results[answered[0] - 1]
+    else:
+        while True:
+            raw = input(f"  Продолжить на варианте № (Enter = {answered[0]}): ").strip()
+            if not raw:
+                chosen = results[answered[0] - 1]
+                break
+            if raw.isdigit() and int(raw) in answered:
+                chosen = results[int(raw) - 1]
+                break
+            print(f"  ⚠ Введите номер варианта с ответом: {', '.join(map(str, answered))}.")
+    print(f"  Дозапросы — на варианте {_describe(results.index(chosen) + 1, chosen.variant)}.\n")
+    return chosen
+
+
+def _parse_temperatures(raw: str) -> list[float]:
+    temperatures = []
+    for part in raw.split(","):
+        try:
+            temperature = float(part)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"температура «{part.strip()}» — не число") from None
+        if not TEMPERATURE_MIN <= temperature <= TEMPERATURE_MAX:
+            raise argparse.ArgumentTypeError(
+                f"температура {temperature} вне интервала {TEMPERATURE_MIN} — {TEMPERATURE_MAX}"
+            )
+        temperatures.append(temperature)
+    return temperatures
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="main.py compare", description="Один промпт — параллельно нескольким моделям и температурам"
+    )
+    parser.add_argument(
+        "--models",
+        type=lambda raw: [model.strip() for model in raw.split(",") if model.strip()],
+        default=[OPENAI_MODEL],
+        help="модели через запятую (по умолчанию OPENAI_MODEL)",
+    )
+    parser.add_argument(
+        "--temperatures",
+        type=_parse_temperatures,
+        help="температуры через запятую (по умолчанию — спросить в диалоге)",
+    )
+    args = parser.parse_args(argv)
+    if not args.models:
+        parser.error("--models не содержит ни одной модели")
+    return args
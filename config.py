@@ -17,6 +17,137 @@ BOT_TOKEN: str = os.getenv("BOT_TOKEN", "")
 
 # Модель для бота (отдельно от CLI)
 BOT_OPENAI_MODEL: str = os.getenv("BOT_OPENAI_MODEL", "gpt-5-mini-2025-08-07")
+# Маршрутизация по моделям: уровни через запятую от лёгкой модели к тяжёлой,
+# модель[:макс. токенов сообщения с историей]; у последнего уровня предела нет.
+# По умолчанию — единственный уровень BOT_OPENAI_MODEL
+BOT_MODEL_TIERS: str = os.getenv("BOT_MODEL_TIERS", BOT_OPENAI_MODEL)
+# Модель считается деградировавшей (пробуется последней), если за ROUTER_HEALTH_WINDOW секунд
+# у неё не меньше ROUTER_MIN_SAMPLES запросов и доля ошибок выше ROUTER_MAX_ERROR_RATE
+# или p90 задержки первого фрагмента выше ROUTER_MAX_LATENCY секунд
+ROUTER_HEALTH_WINDOW: float = float(os.getenv("ROUTER_HEALTH_WINDOW", "60"))
+ROUTER_MIN_SAMPLES: int = int(os.getenv("ROUTER_MIN_SAMPLES", "5"))
+ROUTER_MAX_ERROR_RATE: float = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+ROUTER_MAX_LATENCY: float = float(os.getenv("ROUTER_MAX_LATENCY", "10"))
+
+# System-промпт бота — общий неизменный префикс всех запросов (его кэширует OpenAI).
+# BOT_SYSTEM_PROMPT_FILE — прочитать промпт из файла; пустой BOT_SYSTEM_PROMPT — без system
+BOT_SYSTEM_PROMPT_FILE: str = os.getenv("BOT_SYSTEM_PROMPT_FILE", "")
+BOT_SYSTEM_PROMPT: str = os.getenv(
+    "BOT_SYSTEM_PROMPT",
+    "Ты — полезный ассистент в Telegram. Отвечай на языке пользователя, по существу и без "
+    "лишних вступлений. Для кода используй блоки ``` с указанием языка.",
+)
+if BOT_SYSTEM_PROMPT_FILE:
+    with open(BOT_SYSTEM_PROMPT_FILE, encoding="utf-8") as _prompt_file:
+        BOT_SYSTEM_PROMPT = _prompt_file.read().strip()
 
 # SQLite для учёта токенов
 TOKEN_USAGE_DB_PATH: str = os.getenv("TOKEN_USAGE_DB_PATH", "token_usage.db")
+
+# Пул HTTP-соединений к OpenAI (общий клиент на процесс)
+OPENAI_MAX_CONNECTIONS: int = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY: float = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+
+# Потоковые ответы бота: как часто редактировать сообщение-заглушку
+BOT_STREAM_EDIT_INTERVAL: float = float(os.getenv("BOT_STREAM_EDIT_INTERVAL", "1.5"))
+BOT_STREAM_EDIT_MIN_CHARS: int = int(os.getenv("BOT_STREAM_EDIT_MIN_CHARS", "40"))
+
+# Бюджет токенов на контекст запроса (0 — по таблице моделей в context_manager)
+CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+# До какой доли бюджета обрезается история за раз (крупный шаг держит префикс запроса стабильным)
+CONTEXT_TRIM_TARGET: float = float(os.getenv("CONTEXT_TRIM_TARGET", "0.6"))
+
+# Фоновое сжатие длинной истории в краткое содержание (0 — отключено)
+CONTEXT_SUMMARY_THRESHOLD: int = int(os.getenv("CONTEXT_SUMMARY_THRESHOLD", "12000"))
+CONTEXT_SUMMARY_KEEP_TURNS: int = int(os.getenv("CONTEXT_SUMMARY_KEEP_TURNS", "4"))
+CONTEXT_SUMMARY_MODEL: str = os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-4.1-mini")
+
+# Ограничение памяти под контексты бота (0 — без ограничения)
+CONTEXT_IDLE_TTL: float = float(os.getenv("CONTEXT_IDLE_TTL", "86400"))
+CONTEXT_MAX_BYTES: int = int(os.getenv("CONTEXT_MAX_BYTES", str(256 * 1024 * 1024)))
+CONTEXT_MAX_MESSAGES: int = int(os.getenv("CONTEXT_MAX_MESSAGES", "0"))
+CONTEXT_SWEEP_INTERVAL: float = float(os.getenv("CONTEXT_SWEEP_INTERVAL", "60"))
+# Сжатие zlib реплик старше N последних сообщений (0 — не сжимать)
+CONTEXT_COMPRESS_AFTER: int = int(os.getenv("CONTEXT_COMPRESS_AFTER", "0"))
+
+# Хранилище контекстов бота: memory (в памяти процесса) или sqlite (общий файл, переживает рестарт)
+CONTEXT_BACKEND: str = os.getenv("CONTEXT_BACKEND", "memory")
+CONTEXT_DB_PATH: str = os.getenv("CONTEXT_DB_PATH", "contexts.db")
+CONTEXT_DB_FLUSH_INTERVAL: float = float(os.getenv("CONTEXT_DB_FLUSH_INTERVAL", "1.0"))
+CONTEXT_DB_BATCH_SIZE: int = int(os.getenv("CONTEXT_DB_BATCH_SIZE", "100"))
+
+# Фоновая пакетная запись token_usage
+USAGE_BATCH_SIZE: int = int(os.getenv("USAGE_BATCH_SIZE", "200"))
+USAGE_FLUSH_INTERVAL: float = float(os.getenv("USAGE_FLUSH_INTERVAL", "1.0"))
+
+# Планировщик запросов бота к модели
+OPENAI_MAX_CONCURRENCY: int = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+SCHEDULER_MAX_PENDING: int = int(os.getenv("SCHEDULER_MAX_PENDING", "200"))
+
+# Ограничение частоты запросов к OpenAI (0 — лимит неизвестен, берётся из заголовков ответов)
+OPENAI_RPM_LIMIT: int = int(os.getenv("OPENAI_RPM_LIMIT", "0"))
+OPENAI_TPM_LIMIT: int = int(os.getenv("OPENAI_TPM_LIMIT", "0"))
+# Оценка токенов ответа, если max_tokens не задан
+OPENAI_COMPLETION_TOKENS_ESTIMATE: int = int(os.getenv("OPENAI_COMPLETION_TOKENS_ESTIMATE", "1000"))
+# Сколько секунд повторять запрос после 429 и сколько раз — после сетевых ошибок и 5xx
+OPENAI_RETRY_DEADLINE: float = float(os.getenv("OPENAI_RETRY_DEADLINE", "60"))
+OPENAI_MAX_RETRIES: int = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# Дедлайн вызова модели вместе с ожиданием лимитов и повторами, сек (0 — без дедлайна);
+# у потокового ответа — отдельный дедлайн до первого фрагмента
+OPENAI_TIMEOUT: float = float(os.getenv("OPENAI_TIMEOUT", "120"))
+OPENAI_FIRST_TOKEN_TIMEOUT: float = float(os.getenv("OPENAI_FIRST_TOKEN_TIMEOUT", "30"))
+# Хеджирование: если ответа (первого фрагмента потока) нет дольше перцентиля недавних задержек,
+# отправляется дубликат запроса (0 — не хеджировать); порог не меньше OPENAI_HEDGE_MIN_DELAY,
+# дублей — не больше доли OPENAI_HEDGE_MAX_RATIO от запросов
+OPENAI_HEDGE_PERCENTILE: float = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "0"))
+OPENAI_HEDGE_MIN_DELAY: float = float(os.getenv("OPENAI_HEDGE_MIN_DELAY", "1.0"))
+OPENAI_HEDGE_MIN_SAMPLES: int = int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+OPENAI_HEDGE_MAX_RATIO: float = float(os.getenv("OPENAI_HEDGE_MAX_RATIO", "0.1"))
+
+# Кэш ответов модели: off, memory или sqlite (память + файл)
+RESPONSE_CACHE: str = os.getenv("RESPONSE_CACHE", "off")
+RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_DB_PATH: str = os.getenv("RESPONSE_CACHE_DB_PATH", "response_cache.db")
+# Запросы с большей температурой и без temperature (выборка модели по умолчанию) идут мимо кэша;
+# по умолчанию кэшируются только детерминированные запросы с temperature=0
+RESPONSE_CACHE_MAX_TEMPERATURE: float = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", "0"))
+# on — кэшировать и запросы без temperature (бот её не передаёт): выборка модели по умолчанию
+# считается детерминированной только по явному решению
+RESPONSE_CACHE_NO_TEMPERATURE: bool = os.getenv("RESPONSE_CACHE_NO_TEMPERATURE", "off") == "on"
+
+# Режим получения обновлений: polling (long polling) или webhook (встроенный aiohttp-сервер)
+BOT_MODE: str = os.getenv("BOT_MODE", "polling")
+# Публичный адрес сервера; пусто — вебхук в Telegram не регистрируется (локальная отладка)
+WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Многопроцессный запуск (runner.py): число воркеров (0 — по числу ядер)
+BOT_WORKERS: int = int(os.getenv("BOT_WORKERS", "0"))
+# Воркер отмечается в общей памяти каждые WORKER_HEARTBEAT_INTERVAL секунд; без отметки
+# дольше WORKER_HEARTBEAT_TIMEOUT он считается зависшим и перезапускается
+WORKER_HEARTBEAT_INTERVAL: float = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "1.0"))
+WORKER_HEARTBEAT_TIMEOUT: float = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "30"))
+# Сколько ждать завершения начатых запросов при остановке, сек
+WORKER_DRAIN_TIMEOUT: float = float(os.getenv("WORKER_DRAIN_TIMEOUT", "30"))
+
+# Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (0 — не поднимать);
+# в runner.py воркер N слушает METRICS_PORT + N
+METRICS_PORT: int = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST: str = os.getenv("METRICS_HOST", "127.0.0.1")
+# user_id администраторов через запятую (команда /perf)
+ADMIN_USER_IDS: frozenset[int] = frozenset(
+    int(part) for part in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if part
+)
+
+# Лимиты исходящих запросов к Telegram (запросов в секунду): на всего бота, в личный чат
+# (с запасом TELEGRAM_CHAT_BURST подряд) и в группу; повторов после 429 RetryAfter
+TELEGRAM_GLOBAL_RATE: float = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE: float = float(os.getenv("TELEGRAM_CHAT_RATE", "1.0"))
+TELEGRAM_CHAT_BURST: float = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_GROUP_RATE: float = float(os.getenv("TELEGRAM_GROUP_RATE", "0.33"))
+TELEGRAM_MAX_RETRIES: int = int(os.getenv("TELEGRAM_MAX_RETRIES", "5"))
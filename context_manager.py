@@ -1,16 +1,113 @@
 """
-Управление контекстом диалога: оперативная память (dict) и учёт токенов в SQLite.
+Управление контекстом диалога: оперативная память (ContextStore) и учёт токенов в SQLite.
+
+Число токенов каждого сообщения считается один раз при добавлении в контекст и хранится
+рядом с ним; при сборке запроса старые реплики отбрасываются, чтобы уложиться в бюджет модели.
+Слишком длинная история в фоне сжимается в краткое содержание дешёвой моделью.
+Записи token_usage в боте копятся в очереди и пишутся пакетами одним фоновым писателем;
+вместе с ними обновляются агрегаты по пользователям (всего и по дням) для быстрого /stats.
 """
 
+import asyncio
 import logging
 import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from config import TOKEN_USAGE_DB_PATH
+from config import (
+    CONTEXT_BACKEND,
+    CONTEXT_COMPRESS_AFTER,
+    CONTEXT_DB_BATCH_SIZE,
+    CONTEXT_DB_FLUSH_INTERVAL,
+    CONTEXT_DB_PATH,
+    CONTEXT_IDLE_TTL,
+    CONTEXT_MAX_BYTES,
+    CONTEXT_MAX_MESSAGES,
+    CONTEXT_SUMMARY_KEEP_TURNS,
+    CONTEXT_SUMMARY_MODEL,
+    CONTEXT_SUMMARY_THRESHOLD,
+    CONTEXT_SWEEP_INTERVAL,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_TRIM_TARGET,
+    TOKEN_USAGE_DB_PATH,
+    USAGE_BATCH_SIZE,
+    USAGE_FLUSH_INTERVAL,
+)
+from context_store import ContextBackend, ContextStore, SqliteContextBackend, Turn
+from openai_client import get_chat_response_async
+from tokenizer import count_tokens
 
 logger = logging.getLogger(__name__)
 
-# Контекст по user_id: список сообщений для OpenAI
-_contexts: dict[int, list[dict[str, str]]] = {}
+
+def _create_backend() -> ContextBackend:
+    """Хранилище контекстов по CONTEXT_BACKEND; у sqlite ContextStore служит кэшем."""
+    store = ContextStore(
+        idle_ttl=CONTEXT_IDLE_TTL,
+        max_bytes=CONTEXT_MAX_BYTES,
+        max_messages=CONTEXT_MAX_MESSAGES,
+        compress_after=CONTEXT_COMPRESS_AFTER,
+    )
+    if CONTEXT_BACKEND == "sqlite":
+        return SqliteContextBackend(
+            CONTEXT_DB_PATH,
+            cache=store,
+            flush_interval=CONTEXT_DB_FLUSH_INTERVAL,
+            batch_size=CONTEXT_DB_BATCH_SIZE,
+        )
+    if CONTEXT_BACKEND != "memory":
+        logger.warning("Неизвестный CONTEXT_BACKEND=%r, используется memory", CONTEXT_BACKEND)
+    return store
+
+
+# Контекст по user_id: список реплик (Turn) с числом токенов каждой
+_contexts = _create_backend()
+
+# Бюджет токенов на запрос по префиксу имени модели
+MODEL_TOKEN_BUDGETS: dict[str, int] = {
+    "gpt-5": 32_000,
+    "gpt-4.1": 32_000,
+    "gpt-4o": 16_000,
+}
+DEFAULT_TOKEN_BUDGET = 16_000
+
+# Категории записей token_usage
+USAGE_CHAT = "chat"
+USAGE_SUMMARY = "summary"
+# Ответ из кэша ответов: токены нулевые, запись нужна для честного счёта запросов
+USAGE_CACHE = "cache"
+# Проигравший дубль хеджированного запроса (токены отменённого — оценка)
+USAGE_HEDGE = "hedge"
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога:\n"
+SUMMARY_INSTRUCTION = (
+    "Кратко перескажи диалог пользователя с ассистентом: факты о пользователе, "
+    "его цели, принятые решения и открытые вопросы. Пиши по-русски, без вступлений."
+)
+
+# Фоновые задачи сжатия истории по user_id
+_summary_tasks: dict[int, asyncio.Task] = {}
+
+# Определение колонки токенов, добавляемой миграцией (старые записи — с нулями)
+_TOKEN_COLUMN = "INTEGER NOT NULL DEFAULT 0"
+
+_trim_stats: dict[str, int] = {
+    "prompts": 0,
+    "trimmed_prompts": 0,
+    "turns_dropped": 0,
+    "tokens_saved": 0,
+}
+
+
+def get_token_budget(model: str) -> int:
+    """Бюджет токенов запроса для модели (CONTEXT_TOKEN_BUDGET переопределяет таблицу)."""
+    if CONTEXT_TOKEN_BUDGET > 0:
+        return CONTEXT_TOKEN_BUDGET
+    for prefix, budget in MODEL_TOKEN_BUDGETS.items():
+        if model.startswith(prefix):
+            return budget
+    return DEFAULT_TOKEN_BUDGET
 
 
 def _get_connection() -> sqlite3.Connection:
@@ -23,6 +120,7 @@ def init_token_usage_db() -> None:
     """Создаёт таблицу для учёта токенов по запросам/ответам."""
     try:
         conn = _get_connection()
+        conn.execute("PRAGMA journal_mode=WAL")
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS token_usage (
@@ -31,10 +129,27 @@ def init_token_usage_db() -> None:
                 prompt_tokens INTEGER NOT NULL,
                 completion_tokens INTEGER NOT NULL,
                 total_tokens INTEGER NOT NULL,
-                created_at TEXT DEFAULT (datetime('now'))
+                created_at TEXT DEFAULT (datetime('now')),
+                category TEXT NOT NULL DEFAULT 'chat',
+                cached_tokens INTEGER NOT NULL DEFAULT 0,
+                reasoning_tokens INTEGER NOT NULL DEFAULT 0,
+                model TEXT NOT NULL DEFAULT ''
             )
             """
         )
+        _add_missing_columns(
+            conn,
+            "token_usage",
+            {
+                "category": "TEXT NOT NULL DEFAULT 'chat'",
+                "cached_tokens": _TOKEN_COLUMN,
+                "reasoning_tokens": _TOKEN_COLUMN,
+                # Записи до маршрутизации моделей — с пустой моделью (цены по умолчанию)
+                "model": "TEXT NOT NULL DEFAULT ''",
+            },
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_token_usage_user ON token_usage (user_id)")
+        _init_usage_aggregates(conn)
         conn.commit()
         conn.close()
     except Exception as e:
@@ -42,9 +157,154 @@ def init_token_usage_db() -> None:
         raise
 
 
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: dict[str, str]) -> None:
+    """Миграция схемы: добавляет в таблицу недостающие колонки (имя → определение)."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def _init_usage_aggregates(conn: sqlite3.Connection) -> None:
+    """
+    Таблицы агрегатов token_usage по пользователю и модели; при первом создании заполняются
+    из сырых записей.
+    """
+    # Агрегаты старой схемы (без модели в ключе) производны от token_usage — пересобираем
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(token_usage_totals)")}
+    if columns and "model" not in columns:
+        conn.execute("DROP TABLE token_usage_totals")
+        conn.execute("DROP TABLE IF EXISTS token_usage_daily")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS token_usage_totals (
+            user_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            requests INTEGER NOT NULL,
+            cached_tokens INTEGER NOT NULL DEFAULT 0,
+            reasoning_tokens INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, model)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS token_usage_daily (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            requests INTEGER NOT NULL,
+            cached_tokens INTEGER NOT NULL DEFAULT 0,
+            reasoning_tokens INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, model)
+        )
+        """
+    )
+    if conn.execute("SELECT 1 FROM token_usage_totals LIMIT 1").fetchone():
+        return
+    conn.execute(
+        """
+        INSERT INTO token_usage_totals (user_id, model, prompt_tokens, completion_tokens, requests,
+            cached_tokens, reasoning_tokens)
+        SELECT user_id, model, SUM(prompt_tokens), SUM(completion_tokens), COUNT(*),
+            SUM(cached_tokens), SUM(reasoning_tokens)
+        FROM token_usage GROUP BY user_id, model
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO token_usage_daily (user_id, day, model, prompt_tokens, completion_tokens, requests,
+            cached_tokens, reasoning_tokens)
+        SELECT user_id, date(created_at), model, SUM(prompt_tokens), SUM(completion_tokens), COUNT(*),
+            SUM(cached_tokens), SUM(reasoning_tokens)
+        FROM token_usage GROUP BY user_id, date(created_at), model
+        """
+    )
+
+
 def get_messages(user_id: int) -> list[dict[str, str]]:
     """Возвращает текущий контекст сообщений пользователя (копию списка)."""
-    return list(_contexts.get(user_id, []))
+    return [turn.to_message() for turn in _contexts.get(user_id)]
+
+
+def get_context_tokens(user_id: int) -> int:
+    """Токенов в истории пользователя (без system и нового сообщения)."""
+    return sum(turn.tokens for turn in _contexts.get(user_id))
+
+
+def build_prompt(
+    user_id: int,
+    user_content: str,
+    model: str,
+    *,
+    system_prompt: str | None = None,
+) -> tuple[list[dict[str, str]], int]:
+    """
+    Собирает сообщения для запроса: system, история и новое сообщение пользователя.
+    Возвращает (messages, prompt_tokens) — число токенов уже посчитано по Turn.tokens,
+    его получает ограничитель запросов вместо повторной токенизации.
+
+    Если всё не помещается в бюджет модели, отбрасываются самые старые реплики — шагами
+    по (1 - CONTEXT_TRIM_TARGET) бюджета, отсчитанными от начала истории. Граница отреза
+    зависит только от старых реплик и не сдвигается с каждым новым сообщением, поэтому
+    префикс запроса остаётся в кэше OpenAI, пока история снова не перерастёт бюджет.
+    System-сообщение и последний обмен (пара user/assistant) сохраняются всегда.
+    """
+    history = _contexts.get(user_id)
+    prefix = [{"role": "system", "content": system_prompt}] if system_prompt else []
+    budget = get_token_budget(model)
+    used = count_tokens(user_content) + sum(count_tokens(m["content"]) for m in prefix)
+    used += sum(turn.tokens for turn in history)
+
+    keep_from = 0
+    if used > budget:
+        step = max(1, int(budget * (1 - CONTEXT_TRIM_TARGET)))
+        # Отбрасываем целое число шагов, не меньше превышения
+        cut = -(-(used - budget) // step) * step
+        trimmed = 0
+        while trimmed < cut and keep_from < len(history) - 2:
+            trimmed += history[keep_from].tokens
+            keep_from += 1
+        used -= trimmed
+    # Не начинаем историю с ответа ассистента без его вопроса
+    while keep_from < len(history) and history[keep_from].role == "assistant":
+        used -= history[keep_from].tokens
+        keep_from += 1
+
+    _trim_stats["prompts"] += 1
+    if keep_from:
+        dropped = history[:keep_from]
+        _trim_stats["trimmed_prompts"] += 1
+        _trim_stats["turns_dropped"] += sum(1 for turn in dropped if turn.role == "user")
+        _trim_stats["tokens_saved"] += sum(turn.tokens for turn in dropped)
+        logger.debug(
+            "Контекст user_id=%s обрезан: отброшено %s сообщений, бюджет %s",
+            user_id,
+            keep_from,
+            budget,
+        )
+
+    messages = (
+        prefix
+        + [turn.to_message() for turn in history[keep_from:]]
+        + [{"role": "user", "content": user_content}]
+    )
+    return messages, used
+
+
+def get_trim_stats() -> dict[str, int]:
+    """
+    Статистика обрезки контекста для настройки бюджета.
+
+    Returns:
+        prompts — собрано запросов, trimmed_prompts — из них обрезано,
+        turns_dropped — отброшено реплик пользователя, tokens_saved — сэкономлено токенов.
+    """
+    return dict(_trim_stats)
 
 
 def append_to_context(
@@ -53,52 +313,431 @@ def append_to_context(
     assistant_content: str,
 ) -> None:
     """Добавляет пару user/assistant в контекст пользователя."""
-    if user_id not in _contexts:
-        _contexts[user_id] = []
-    _contexts[user_id].append({"role": "user", "content": user_content})
-    _contexts[user_id].append({"role": "assistant", "content": assistant_content})
+    _contexts.extend(
+        user_id,
+        [
+            Turn("user", user_content, count_tokens(user_content)),
+            Turn("assistant", assistant_content, count_tokens(assistant_content)),
+        ],
+    )
+
+
+def schedule_summary(user_id: int) -> None:
+    """
+    Запускает фоновое сжатие истории, если она длиннее CONTEXT_SUMMARY_THRESHOLD токенов.
+
+    Не блокирует вызывающего: пока сжатие идёт, запросы используют прежнюю историю.
+    Для одного пользователя одновременно работает не больше одной задачи.
+    """
+    if CONTEXT_SUMMARY_THRESHOLD <= 0 or user_id in _summary_tasks:
+        return
+    history = _contexts.get(user_id)
+    if sum(turn.tokens for turn in history) <= CONTEXT_SUMMARY_THRESHOLD:
+        return
+    task = asyncio.create_task(_summarize(user_id))
+    _summary_tasks[user_id] = task
+    task.add_done_callback(lambda _: _summary_tasks.pop(user_id, None))
+
+
+async def _summarize(user_id: int) -> None:
+    history = _contexts.get(user_id)
+    cut = len(history) - 2 * CONTEXT_SUMMARY_KEEP_TURNS
+    # Не сжимаем одно лишь предыдущее краткое содержание
+    if cut < 2:
+        return
+    snapshot = history[:cut]
+    dialog = "\n\n".join(f"{turn.role}: {turn.content}" for turn in snapshot)
+    try:
+        summary, usage = await get_chat_response_async(
+            [
+                {"role": "system", "content": SUMMARY_INSTRUCTION},
+                {"role": "user", "content": dialog},
+            ],
+            CONTEXT_SUMMARY_MODEL,
+        )
+    except Exception as e:
+        logger.warning("Не удалось сжать контекст user_id=%s: %s", user_id, e)
+        return
+
+    if usage:
+        log_response_usage(user_id, usage, category=USAGE_SUMMARY, model=CONTEXT_SUMMARY_MODEL)
+
+    # Пока шёл запрос, контекст мог быть очищен или сжат заново — тогда результат не нужен
+    content = SUMMARY_PREFIX + summary
+    replacement = [Turn("system", content, count_tokens(content))]
+    if not _contexts.replace_prefix(user_id, snapshot, replacement):
+        return
+    logger.info("Контекст user_id=%s сжат: %s сообщений → краткое содержание", user_id, cut)
+
+
+async def cancel_summaries() -> None:
+    """Отменяет незавершённые задачи сжатия (при остановке бота)."""
+    tasks = list(_summary_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 
 
 def clear_context(user_id: int) -> None:
     """Очищает контекст диалога для пользователя."""
-    _contexts[user_id] = []
+    _contexts.clear(user_id)
     logger.info("Контекст очищен для user_id=%s", user_id)
 
 
+def get_context_stats() -> dict[str, int]:
+    """
+    Счётчики хранилища контекстов для оценки памяти.
+
+    Returns:
+        users — пользователей в памяти, messages — сообщений, bytes — оценка занятой памяти,
+        evicted_idle / evicted_lru — удалено по простою / вытеснено по лимиту.
+    """
+    return _contexts.stats()
+
+
+def measure_context_memory(user_id: int | None = None) -> dict[str, float]:
+    """
+    Байт на пользователя в компактном представлении и в прежнем (список словарей).
+
+    Args:
+        user_id: Конкретный пользователь; None — среднее по всем пользователям в памяти.
+    """
+    return _contexts.measure(user_id)
+
+
+async def start_context_backend() -> None:
+    """Запускает фоновые задачи хранилища контекстов (при старте бота)."""
+    await _contexts.start()
+
+
+async def close_context_backend() -> None:
+    """Сохраняет несохранённые контексты и закрывает хранилище (при остановке бота)."""
+    await _contexts.close()
+
+
+async def run_context_sweeper() -> None:
+    """Периодически удаляет простаивающие контексты (фоновая задача бота)."""
+    while True:
+        await asyncio.sleep(CONTEXT_SWEEP_INTERVAL)
+        evicted = _contexts.sweep()
+        if evicted:
+            logger.info("Удалено простаивающих контекстов: %s (%s)", evicted, _contexts.stats())
+
+
+_INSERT_USAGE_SQL = (
+    "INSERT INTO token_usage (user_id, prompt_tokens, completion_tokens, total_tokens, category, "
+    "cached_tokens, reasoning_tokens, model) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# Строка token_usage: (user_id, prompt_tokens, completion_tokens, total_tokens, category,
+# cached_tokens, reasoning_tokens, model)
+UsageRow = tuple[int, int, int, int, str, int, int, str]
+
+# Статистика пользователя по модели: (prompt_tokens, completion_tokens, cached_tokens, reasoning_tokens)
+TokenStats = tuple[int, int, int, int]
+
+_AGGREGATE_UPDATE = """
+        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+        completion_tokens = completion_tokens + excluded.completion_tokens,
+        requests = requests + excluded.requests,
+        cached_tokens = cached_tokens + excluded.cached_tokens,
+        reasoning_tokens = reasoning_tokens + excluded.reasoning_tokens
+"""
+_UPSERT_TOTALS_SQL = (
+    """
+    INSERT INTO token_usage_totals
+        (user_id, model, prompt_tokens, completion_tokens, requests, cached_tokens, reasoning_tokens)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, model) DO UPDATE SET"""
+    + _AGGREGATE_UPDATE
+)
+_UPSERT_DAILY_SQL = (
+    """
+    INSERT INTO token_usage_daily
+        (user_id, day, model, prompt_tokens, completion_tokens, requests, cached_tokens, reasoning_tokens)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, day, model) DO UPDATE SET"""
+    + _AGGREGATE_UPDATE
+)
+
+# Кэш ответов get_user_token_stats: (user_id, days) → (день UTC, {модель: TokenStats})
+_STATS_CACHE_SIZE = 10_000
+_stats_cache: OrderedDict[tuple[int, int | None], tuple[str, dict[str, TokenStats]]] = OrderedDict()
+
+
+def _utc_today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def _write_usage_rows(conn: sqlite3.Connection, rows: list[UsageRow]) -> None:
+    """Одной транзакцией пишет сырые строки и обновляет агрегаты (всего и за сегодня)."""
+    # (user_id, model) → [prompt_tokens, completion_tokens, requests, cached_tokens, reasoning_tokens]
+    totals: dict[tuple[int, str], list[int]] = {}
+    for user_id, prompt_tokens, completion_tokens, _, _, cached_tokens, reasoning_tokens, model in rows:
+        acc = totals.setdefault((user_id, model), [0, 0, 0, 0, 0])
+        acc[0] += prompt_tokens
+        acc[1] += completion_tokens
+        acc[2] += 1
+        acc[3] += cached_tokens
+        acc[4] += reasoning_tokens
+    day = _utc_today()
+    with conn:
+        conn.executemany(_INSERT_USAGE_SQL, rows)
+        conn.executemany(_UPSERT_TOTALS_SQL, [(u, m, *acc) for (u, m), acc in totals.items()])
+        conn.executemany(_UPSERT_DAILY_SQL, [(u, day, m, *acc) for (u, m), acc in totals.items()])
+
+
+def _invalidate_stats_cache(user_ids: set[int]) -> None:
+    for key in [key for key in _stats_cache if key[0] in user_ids]:
+        del _stats_cache[key]
+
+
+class UsageWriter:
+    """
+    Пакетная запись token_usage из очереди одним фоновым писателем.
+
+    Писатель держит одно соединение (WAL, synchronous=NORMAL) и коммитит пакет через
+    executemany, как только набралось batch_size строк или прошло flush_interval секунд
+    с первой строки пакета. Запись идёт в отдельном потоке и не блокирует цикл событий.
+    Строки пакета, который не удалось записать (например, «database is locked» при
+    нескольких процессах), остаются в памяти и пишутся первыми в следующем пакете.
+    """
+
+    def __init__(self, *, batch_size: int, flush_interval: float) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue[UsageRow | None] = asyncio.Queue()
+        self._conn: sqlite3.Connection | None = None
+        self._task: asyncio.Task | None = None
+        # Строки упавшего пакета (это данные для биллинга — не теряем)
+        self._failed: list[UsageRow] = []
+        self._rows_written = 0
+        self._flushes = 0
+        self._flush_seconds_total = 0.0
+        self._flush_seconds_last = 0.0
+        self._flush_seconds_max = 0.0
+
+    def submit(self, row: UsageRow) -> None:
+        self._queue.put_nowait(row)
+
+    async def start(self) -> None:
+        self._conn = await asyncio.to_thread(_get_connection)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Дописывает всё из очереди и закрывает соединение."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        self._conn.close()
+        self._conn = None
+
+    def stats(self) -> dict[str, float]:
+        """Глубина очереди, число записанных строк и пакетов, время записи пакета (сек)."""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "rows_written": self._rows_written,
+            "failed_rows": len(self._failed),
+            "flushes": self._flushes,
+            "flush_seconds_last": self._flush_seconds_last,
+            "flush_seconds_max": self._flush_seconds_max,
+            "flush_seconds_avg": self._flush_seconds_total / self._flushes if self._flushes else 0.0,
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._failed:
+                # Упавший пакет повторяется и без новых строк
+                try:
+                    first = await asyncio.wait_for(self._queue.get(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    await self._flush([])
+                    continue
+            else:
+                first = await self._queue.get()
+            if first is None:
+                if self._failed:
+                    await self._flush([])
+                return
+            batch = [first]
+            stop = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    row = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        row = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if row is None:
+                    stop = True
+                    break
+                batch.append(row)
+            await self._flush(batch)
+            if stop:
+                return
+
+    async def _flush(self, batch: list[UsageRow]) -> None:
+        batch, self._failed = self._failed + batch, []
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(_write_usage_rows, self._conn, batch)
+        except Exception as e:
+            self._failed = batch
+            logger.exception("Ошибка записи token_usage (%s строк), повтор со следующим пакетом: %s", len(batch), e)
+            return
+        _invalidate_stats_cache({row[0] for row in batch})
+        elapsed = time.perf_counter() - started
+        self._rows_written += len(batch)
+        self._flushes += 1
+        self._flush_seconds_total += elapsed
+        self._flush_seconds_last = elapsed
+        self._flush_seconds_max = max(self._flush_seconds_max, elapsed)
+
+
+_usage_writer: UsageWriter | None = None
+
+
+async def start_usage_writer() -> None:
+    """Запускает фоновую пакетную запись token_usage (при старте бота)."""
+    global _usage_writer
+    writer = UsageWriter(batch_size=USAGE_BATCH_SIZE, flush_interval=USAGE_FLUSH_INTERVAL)
+    await writer.start()
+    _usage_writer = writer
+
+
+async def stop_usage_writer() -> None:
+    """Дописывает очередь token_usage и останавливает писателя (при остановке бота)."""
+    global _usage_writer
+    if _usage_writer is not None:
+        writer, _usage_writer = _usage_writer, None
+        await writer.close()
+
+
+def get_usage_writer_stats() -> dict[str, float]:
+    """Метрики писателя token_usage (пусто, если он не запущен)."""
+    return _usage_writer.stats() if _usage_writer else {}
+
+
 def log_token_usage(
     user_id: int,
     prompt_tokens: int,
     completion_tokens: int,
     total_tokens: int,
+    *,
+    category: str = USAGE_CHAT,
+    cached_tokens: int = 0,
+    reasoning_tokens: int = 0,
+    model: str = "",
 ) -> None:
-    """Сохраняет информацию о потраченных токенах в SQLite."""
+    """
+    Сохраняет информацию о потраченных токенах в SQLite (category — chat или summary).
+
+    cached_tokens — часть prompt_tokens из кэша префиксов OpenAI, reasoning_tokens — часть
+    completion_tokens на рассуждения, model — модель ответа (по ней считается стоимость).
+    Если запущен фоновый писатель — только ставит строку в очередь; иначе пишет сразу.
+    """
+    row = (
+        user_id,
+        prompt_tokens,
+        completion_tokens,
+        total_tokens,
+        category,
+        cached_tokens,
+        reasoning_tokens,
+        model,
+    )
+    if _usage_writer is not None:
+        _usage_writer.submit(row)
+        return
     try:
         conn = _get_connection()
-        conn.execute(
-            "INSERT INTO token_usage (user_id, prompt_tokens, completion_tokens, total_tokens) VALUES (?, ?, ?, ?)",
-            (user_id, prompt_tokens, completion_tokens, total_tokens),
-        )
-        conn.commit()
+        _write_usage_rows(conn, [row])
         conn.close()
     except Exception as e:
         logger.exception("Ошибка записи token_usage: %s", e)
+        return
+    _invalidate_stats_cache({user_id})
 
 
-def get_user_token_stats(user_id: int) -> tuple[int, int]:
+def log_response_usage(user_id: int, usage: dict[str, int], *, category: str, model: str) -> None:
     """
-    Возвращает суммарные токены запросов и ответов для пользователя.
+    Сохраняет usage ответа openai_client; токены дубля хеджированного запроса
+    (hedge_prompt_tokens / hedge_completion_tokens) — отдельной строкой с категорией hedge.
+    """
+    log_token_usage(
+        user_id,
+        usage["prompt_tokens"],
+        usage["completion_tokens"],
+        usage["total_tokens"],
+        category=category,
+        cached_tokens=usage["cached_tokens"],
+        reasoning_tokens=usage["reasoning_tokens"],
+        model=model,
+    )
+    if "hedge_prompt_tokens" in usage:
+        prompt_tokens, completion_tokens = usage["hedge_prompt_tokens"], usage["hedge_completion_tokens"]
+        log_token_usage(
+            user_id,
+            prompt_tokens,
+            completion_tokens,
+            prompt_tokens + completion_tokens,
+            category=USAGE_HEDGE,
+            model=model,
+        )
+
+
+def get_user_token_stats(user_id: int, days: int | None = None) -> dict[str, TokenStats]:
+    """
+    Возвращает суммарные токены запросов и ответов пользователя по моделям.
+
+    Читает агрегаты (token_usage_totals / token_usage_daily), а не сырые записи;
+    результат кэшируется до следующей записи токенов этого пользователя.
+
+    Args:
+        user_id: Пользователь.
+        days: Окно в днях, включая сегодняшний (1 — сегодня, 7, 30); None — за всё время.
 
     Returns:
-        (total_prompt_tokens, total_completion_tokens)
+        {модель: (prompt_tokens, completion_tokens, cached_tokens, reasoning_tokens)} — cached
+        входят в prompt, reasoning — в completion; модель "" — записи до учёта моделей.
     """
+    key = (user_id, days)
+    day = _utc_today()
+    cached = _stats_cache.get(key)
+    if cached is not None and cached[0] == day:
+        _stats_cache.move_to_end(key)
+        return cached[1]
     try:
         conn = _get_connection()
-        row = conn.execute(
-            "SELECT COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0) FROM token_usage WHERE user_id = ?",
-            (user_id,),
-        ).fetchone()
+        if days is None:
+            rows = conn.execute(
+                "SELECT model, prompt_tokens, completion_tokens, cached_tokens, reasoning_tokens "
+                "FROM token_usage_totals WHERE user_id = ?",
+                (user_id,),
+            ).fetchall()
+        else:
+            since = (datetime.fromisoformat(day) - timedelta(days=days - 1)).date().isoformat()
+            rows = conn.execute(
+                "SELECT model, SUM(prompt_tokens), SUM(completion_tokens), SUM(cached_tokens), "
+                "SUM(reasoning_tokens) FROM token_usage_daily WHERE user_id = ? AND day >= ? "
+                "GROUP BY model",
+                (user_id, since),
+            ).fetchall()
         conn.close()
-        return (row[0], row[1]) if row else (0, 0)
     except Exception as e:
         logger.exception("Ошибка чтения статистики токенов: %s", e)
-        return (0, 0)
+        return {}
+    result = {row[0]: tuple(row[1:]) for row in rows}
+    _stats_cache[key] = (day, result)
+    if len(_stats_cache) > _STATS_CACHE_SIZE:
+        _stats_cache.popitem(last=False)
+    return result
@@ -0,0 +1,490 @@
+"""
+Хранилища контекстов диалогов: общий интерфейс ContextBackend, память (ContextStore)
+и SQLite (SqliteContextBackend) с отложенной пакетной записью и кэшем в памяти.
+
+Пользователи, давно не писавшие боту, удаляются по TTL простоя; при превышении общего лимита
+байт или сообщений вытесняются наименее недавно активные (LRU).
+
+Реплики хранятся компактно (Turn со __slots__ и интернированной ролью), старые реплики можно
+сжимать zlib; словари для OpenAI создаются только при сборке запроса.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class Turn:
+    """Реплика диалога: роль, текст (str или zlib-сжатые байты) и число токенов."""
+
+    __slots__ = ("role", "tokens", "_data")
+
+    def __init__(self, role: str, content: str, tokens: int) -> None:
+        self.role = sys.intern(role)
+        self.tokens = tokens
+        self._data: str | bytes = content
+
+    @property
+    def content(self) -> str:
+        if isinstance(self._data, bytes):
+            return zlib.decompress(self._data).decode("utf-8")
+        return self._data
+
+    @property
+    def compressed(self) -> bool:
+        return isinstance(self._data, bytes)
+
+    def compress(self, min_bytes: int) -> None:
+        """Сжимает текст, если он не короче min_bytes и сжатие действительно экономит память."""
+        if self.compressed or len(self._data) < min_bytes:
+            return
+        packed = zlib.compress(self._data.encode("utf-8"))
+        if sys.getsizeof(packed) < sys.getsizeof(self._data):
+            self._data = packed
+
+    def to_message(self) -> dict[str, str]:
+        """Сообщение в формате OpenAI Chat API."""
+        return {"role": self.role, "content": self.content}
+
+    def size(self) -> int:
+        """Приблизительный размер реплики в памяти, байт."""
+        return sys.getsizeof(self) + sys.getsizeof(self._data)
+
+
+def dict_layout_size(turns: list[Turn]) -> int:
+    """Размер тех же реплик в прежнем представлении — списке словарей {"role", "content"}, байт."""
+    size = sys.getsizeof([None] * len(turns))
+    for turn in turns:
+        size += sys.getsizeof(turn.to_message()) + sys.getsizeof(turn.content)
+    return size
+
+
+class ContextBackend(ABC):
+    """
+    Интерфейс хранилища контекстов, через который работает context_manager.
+
+    Реализации: ContextStore (память процесса) и SqliteContextBackend (файл SQLite,
+    общий для нескольких процессов). Методы вызываются из цикла событий и не должны
+    надолго его блокировать.
+    """
+
+    @abstractmethod
+    def get(self, user_id: int) -> list[Turn]:
+        """Возвращает реплики пользователя (только для чтения)."""
+
+    @abstractmethod
+    def extend(self, user_id: int, new_entries: list[Turn]) -> None:
+        """Добавляет реплики в конец контекста пользователя."""
+
+    @abstractmethod
+    def replace_prefix(self, user_id: int, snapshot: list[Turn], replacement: list[Turn]) -> bool:
+        """Заменяет начало контекста, если оно не изменилось с момента snapshot."""
+
+    @abstractmethod
+    def clear(self, user_id: int) -> None:
+        """Удаляет контекст пользователя."""
+
+    @abstractmethod
+    def stats(self) -> dict[str, int]:
+        """Счётчики для мониторинга."""
+
+    def sweep(self) -> int:
+        """Удаляет простаивающие контексты из памяти. Возвращает число удалённых."""
+        return 0
+
+    def measure(self, user_id: int | None = None) -> dict[str, float]:
+        """Оценка памяти на пользователя (см. ContextStore.measure)."""
+        return {}
+
+    async def start(self) -> None:
+        """Запускает фоновые задачи хранилища (при старте бота)."""
+
+    async def close(self) -> None:
+        """Сохраняет несохранённое и освобождает ресурсы (при остановке бота)."""
+
+
+class ContextStore(ContextBackend):
+    """
+    Контексты по user_id в памяти процесса с LRU/TTL-вытеснением.
+
+    Args:
+        idle_ttl: Через сколько секунд простоя контекст удаляется (0 — не удалять).
+        max_bytes: Общий лимит памяти под контексты, байт (0 — без лимита).
+        max_messages: Общий лимит числа сообщений (0 — без лимита).
+        compress_after: Сжимать реплики старше стольких последних сообщений (0 — не сжимать).
+        compress_min_bytes: Не сжимать реплики короче этого размера.
+    """
+
+    def __init__(
+        self,
+        *,
+        idle_ttl: float = 0,
+        max_bytes: int = 0,
+        max_messages: int = 0,
+        compress_after: int = 0,
+        compress_min_bytes: int = 256,
+    ) -> None:
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.compress_after = compress_after
+        self.compress_min_bytes = compress_min_bytes
+        # Порядок ключей — порядок последнего обращения (в начале — самые давние)
+        self._entries: OrderedDict[int, list[Turn]] = OrderedDict()
+        self._last_access: dict[int, float] = {}
+        self._user_bytes: dict[int, int] = {}
+        self._bytes = 0
+        self._messages = 0
+        self._evicted_idle = 0
+        self._evicted_lru = 0
+
+    def get(self, user_id: int) -> list[Turn]:
+        """Возвращает реплики пользователя (только для чтения) и отмечает обращение."""
+        entries = self._entries.get(user_id)
+        if entries is None:
+            return []
+        self._touch(user_id)
+        return entries
+
+    def contains(self, user_id: int) -> bool:
+        """Есть ли у пользователя запись в памяти (в том числе пустая — «история пуста»)."""
+        return user_id in self._entries
+
+    def extend(self, user_id: int, new_entries: list[Turn]) -> None:
+        """Добавляет реплики в конец контекста пользователя (пустой список — создаёт пустую запись)."""
+        entries = self._entries.setdefault(user_id, [])
+        entries.extend(new_entries)
+        added = sum(turn.size() for turn in new_entries)
+        if self.compress_after > 0:
+            # Сжимаем реплики, которые только что вышли из «свежего» окна
+            end = len(entries) - self.compress_after
+            for turn in entries[max(0, end - len(new_entries)) : max(0, end)]:
+                before = turn.size()
+                turn.compress(self.compress_min_bytes)
+                added += turn.size() - before
+        self._user_bytes[user_id] = self._user_bytes.get(user_id, 0) + added
+        self._bytes += added
+        self._messages += len(new_entries)
+        self._touch(user_id)
+        self._enforce_limits()
+
+    def replace_prefix(self, user_id: int, snapshot: list[Turn], replacement: list[Turn]) -> bool:
+        """
+        Заменяет начало контекста (snapshot) на replacement.
+
+        Замена выполняется, только если контекст по-прежнему начинается с тех же записей;
+        иначе (очищен, вытеснен, сжат заново) возвращает False.
+        """
+        entries = self._entries.get(user_id)
+        if entries is None or len(entries) < len(snapshot):
+            return False
+        if any(a is not b for a, b in zip(entries, snapshot)):
+            return False
+        removed = sum(turn.size() for turn in snapshot)
+        added = sum(turn.size() for turn in replacement)
+        entries[: len(snapshot)] = replacement
+        self._user_bytes[user_id] += added - removed
+        self._bytes += added - removed
+        self._messages += len(replacement) - len(snapshot)
+        return True
+
+    def clear(self, user_id: int) -> None:
+        """Удаляет контекст пользователя целиком."""
+        self._pop(user_id)
+
+    def sweep(self) -> int:
+        """Удаляет контексты, простаивающие дольше idle_ttl. Возвращает число удалённых."""
+        if self.idle_ttl <= 0:
+            return 0
+        deadline = time.monotonic() - self.idle_ttl
+        evicted = 0
+        while self._entries:
+            user_id = next(iter(self._entries))
+            if self._last_access[user_id] > deadline:
+                break
+            self._pop(user_id)
+            evicted += 1
+        self._evicted_idle += evicted
+        return evicted
+
+    def stats(self) -> dict[str, int]:
+        """Счётчики: users, messages, bytes, evicted_idle, evicted_lru."""
+        return {
+            "users": len(self._entries),
+            "messages": self._messages,
+            "bytes": self._bytes,
+            "evicted_idle": self._evicted_idle,
+            "evicted_lru": self._evicted_lru,
+        }
+
+    def measure(self, user_id: int | None = None) -> dict[str, float]:
+        """
+        Память на пользователя в текущем представлении и в прежнем (список словарей).
+
+        Args:
+            user_id: Конкретный пользователь; None — среднее по всем пользователям в памяти.
+
+        Returns:
+            users, compact_bytes_per_user, dict_bytes_per_user.
+        """
+        if user_id is None:
+            user_ids = list(self._entries)
+        else:
+            user_ids = [user_id] if user_id in self._entries else []
+        if not user_ids:
+            return {"users": 0, "compact_bytes_per_user": 0.0, "dict_bytes_per_user": 0.0}
+        compact = sum(self._user_bytes[u] + sys.getsizeof(self._entries[u]) for u in user_ids)
+        dicts = sum(dict_layout_size(self._entries[u]) for u in user_ids)
+        return {
+            "users": len(user_ids),
+            "compact_bytes_per_user": compact / len(user_ids),
+            "dict_bytes_per_user": dicts / len(user_ids),
+        }
+
+    def _touch(self, user_id: int) -> None:
+        self._entries.move_to_end(user_id)
+        self._last_access[user_id] = time.monotonic()
+
+    def _pop(self, user_id: int) -> None:
+        entries = self._entries.pop(user_id, None)
+        if entries is None:
+            return
+        self._last_access.pop(user_id, None)
+        self._bytes -= self._user_bytes.pop(user_id, 0)
+        self._messages -= len(entries)
+
+    def _over_limit(self) -> bool:
+        return (self.max_bytes > 0 and self._bytes > self.max_bytes) or (
+            self.max_messages > 0 and self._messages > self.max_messages
+        )
+
+    def _enforce_limits(self) -> None:
+        # Самого недавнего пользователя не вытесняем, даже если он один превышает лимит
+        while len(self._entries) > 1 and self._over_limit():
+            self._pop(next(iter(self._entries)))
+            self._evicted_lru += 1
+
+
+class SqliteContextBackend(ContextBackend):
+    """
+    Контексты в SQLite (режим WAL) с кэшем в памяти и отложенной записью.
+
+    Чтение идёт через кэш (ContextStore): диск читается только при промахе, например
+    после рестарта или вытеснения пользователя из кэша; пустая история тоже запоминается
+    в кэше, поэтому новый пользователь читается с диска один раз. Изменения копятся в очереди и
+    записываются одной транзакцией раз в flush_interval секунд или по накоплении
+    batch_size операций. Кэш каждого процесса считается верным для «своих» пользователей,
+    поэтому при нескольких процессах сообщения одного пользователя должны
+    обрабатываться одним процессом. Операции пакета, который не удалось записать, остаются
+    в памяти и пишутся первыми в следующем пакете. Промах кэша у пользователя с ещё
+    не записанными изменениями не ждёт записи: они накладываются на прочитанное с диска.
+
+    Args:
+        path: Путь к файлу базы.
+        cache: Кэш в памяти (его лимиты ограничивают только кэш, не базу).
+        flush_interval: Максимальная задержка записи на диск, сек.
+        batch_size: Число накопленных операций, при котором запись начинается сразу.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        cache: ContextStore,
+        flush_interval: float = 1.0,
+        batch_size: int = 100,
+    ) -> None:
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._cache = cache
+        db_path = Path(path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS context_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                tokens INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_context_messages_user ON context_messages (user_id, id)"
+        )
+        self._conn.commit()
+        # Очередь операций: (вид, user_id, строки (role, content, tokens))
+        self._pending: list[tuple[str, int, list[tuple[str, str, int]]]] = []
+        # Операции пакета, запись которого упала (пишутся перед следующим пакетом)
+        self._failed: list[tuple[str, int, list[tuple[str, str, int]]]] = []
+        # Пакеты, взятые на запись, но ещё не записанные: номер → операции
+        self._inflight: dict[int, list[tuple[str, int, list[tuple[str, str, int]]]]] = {}
+        # Пакеты пишутся строго по порядку номеров, даже из разных потоков
+        self._cond = threading.Condition()
+        self._next_batch = 0
+        self._written_batch = 0
+        # user_id → номер последнего пакета с изменениями пользователя
+        self._dirty: dict[int, int] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._flushes = 0
+        self._rows_written = 0
+        self._cache_misses = 0
+
+    def get(self, user_id: int) -> list[Turn]:
+        if self._cache.contains(user_id):
+            return self._cache.get(user_id)
+        self._cache_misses += 1
+        with self._cond:
+            rows = self._conn.execute(
+                "SELECT role, content, tokens FROM context_messages WHERE user_id = ? ORDER BY id",
+                (user_id,),
+            ).fetchall()
+            # Несохранённые изменения пользователя накладываются на прочитанное, а не
+            # записываются здесь: запись в событийном цикле блокировала бы его
+            if user_id in self._dirty:
+                rows = self._apply_unwritten(user_id, rows)
+        # Пустой результат тоже кэшируется — следующий get() не пойдёт на диск
+        self._cache.extend(user_id, [Turn(role, content, tokens) for role, content, tokens in rows])
+        return self._cache.get(user_id)
+
+    def extend(self, user_id: int, new_entries: list[Turn]) -> None:
+        self.get(user_id)  # подгружаем историю в кэш, чтобы не дописать к пустому
+        self._cache.extend(user_id, new_entries)
+        self._enqueue("append", user_id, new_entries)
+
+    def replace_prefix(self, user_id: int, snapshot: list[Turn], replacement: list[Turn]) -> bool:
+        if not self._cache.replace_prefix(user_id, snapshot, replacement):
+            return False
+        self._enqueue("replace", user_id, self._cache.get(user_id))
+        return True
+
+    def clear(self, user_id: int) -> None:
+        self._cache.clear(user_id)
+        # История известна — пустая; без записи в кэше следующий get() читал бы диск
+        self._cache.extend(user_id, [])
+        self._enqueue("clear", user_id, [])
+
+    def sweep(self) -> int:
+        return self._cache.sweep()
+
+    def measure(self, user_id: int | None = None) -> dict[str, float]:
+        return self._cache.measure(user_id)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            **self._cache.stats(),
+            "pending_ops": len(self._pending),
+            "failed_ops": len(self._failed),
+            "flushes": self._flushes,
+            "rows_written": self._rows_written,
+            "cache_misses": self._cache_misses,
+        }
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        self._conn.close()
+
+    async def flush(self) -> None:
+        """Записывает накопленные операции в базу (в отдельном потоке)."""
+        if self._pending or self._failed:
+            try:
+                await asyncio.to_thread(self._write, *self._take_batch())
+            finally:
+                self._dirty = {u: n for u, n in self._dirty.items() if n >= self._written_batch}
+                # Несохранённые операции войдут в следующий пакет — пользователь остаётся «грязным»
+                for _, user_id, _ in self._failed:
+                    self._dirty[user_id] = self._next_batch
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception("Ошибка записи контекстов в SQLite: %s", e)
+
+    def _enqueue(self, kind: str, user_id: int, turns: list[Turn]) -> None:
+        rows = [(turn.role, turn.content, turn.tokens) for turn in turns]
+        self._pending.append((kind, user_id, rows))
+        self._dirty[user_id] = self._next_batch
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def _take_batch(self) -> tuple[int, list[tuple[str, int, list[tuple[str, str, int]]]]]:
+        ops, self._pending = self._pending, []
+        number = self._next_batch
+        self._next_batch += 1
+        self._inflight[number] = ops
+        return number, ops
+
+    def _apply_unwritten(self, user_id: int, rows: list[tuple[str, str, int]]) -> list[tuple[str, str, int]]:
+        """
+        Строки пользователя с учётом операций, которых ещё нет в базе: упавших, записываемых
+        и ожидающих пакета. Вызывается под _cond — пакет не записывается посередине чтения.
+        """
+        ops = list(self._failed)
+        for number in sorted(self._inflight):
+            ops.extend(self._inflight[number])
+        ops.extend(self._pending)
+        rows = list(rows)
+        for kind, op_user_id, op_rows in ops:
+            if op_user_id != user_id:
+                continue
+            if kind in ("clear", "replace"):
+                rows = []
+            rows.extend(op_rows)
+        return rows
+
+    def _write(self, number: int, ops: list[tuple[str, int, list[tuple[str, str, int]]]]) -> None:
+        with self._cond:
+            self._cond.wait_for(lambda: self._written_batch == number)
+            # Пакеты пишутся по порядку, поэтому упавшие операции идут раньше новых
+            ops, self._failed = self._failed + ops, []
+            try:
+                rows_written = 0
+                with self._conn:
+                    for kind, user_id, rows in ops:
+                        if kind in ("clear", "replace"):
+                            self._conn.execute(
+                                "DELETE FROM context_messages WHERE user_id = ?", (user_id,)
+                            )
+                        if rows:
+                            self._conn.executemany(
+                                "INSERT INTO context_messages (user_id, role, content, tokens) VALUES (?, ?, ?, ?)",
+                                [(user_id, *row) for row in rows],
+                            )
+                            rows_written += len(rows)
+                self._rows_written += rows_written
+                self._flushes += 1
+            except sqlite3.Error:
+                self._failed = ops
+                raise
+            finally:
+                self._inflight.pop(number, None)
+                self._written_batch += 1
+                self._cond.notify_all()
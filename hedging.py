@@ -0,0 +1,195 @@
+"""
+Хеджирование запросов к модели против «хвоста» задержек.
+
+Для каждого ключа (модель и вид задержки: полный ответ или первый фрагмент потока) хранятся
+недавние задержки. Если попытка не завершилась за перцентиль этих задержек, запускается
+дубликат; берётся результат той попытки, что завершится первой, вторая отменяется.
+Доля дублей ограничена max_ratio, чтобы при общей деградации API не удваивать нагрузку.
+
+Задержка отменённой основной попытки неизвестна, поэтому в расчёте порога она считается
+бесконечной, а p99 «без хеджирования» оценивается по запросам, которые не хеджировались
+(каждый CONTROL_EVERY-й запрос — контрольный, даже когда хеджирование включено).
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+T = TypeVar("T")
+
+# Сколько последних задержек хранится на ключ
+WINDOW_SIZE = 500
+# Порог пересчитывается раз в столько новых замеров
+_THRESHOLD_REFRESH = 20
+# Каждый такой запрос не хеджируется — контрольная группа для p99 без хеджирования
+CONTROL_EVERY = 20
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class HedgeSeries:
+    """Задержки и счётчики одного ключа."""
+
+    __slots__ = (
+        "requests",
+        "hedged",
+        "hedge_wins",
+        "primary",
+        "control",
+        "effective",
+        "threshold",
+        "_fresh",
+    )
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        # Задержки основной попытки (отменённой — inf), нехеджированных запросов и фактические
+        self.primary: deque[float] = deque(maxlen=WINDOW_SIZE)
+        self.control: deque[float] = deque(maxlen=WINDOW_SIZE)
+        self.effective: deque[float] = deque(maxlen=WINDOW_SIZE)
+        self.threshold: float | None = None
+        self._fresh = 0
+
+    def observe(self, primary: float | None, effective: float, *, control: bool) -> None:
+        if primary is not None:
+            self.primary.append(primary)
+            self._fresh += 1
+        if control:
+            self.control.append(effective)
+        self.effective.append(effective)
+
+
+class Hedger:
+    """
+    Запуск попыток с дублированием по порогу задержки.
+
+    Args:
+        percentile: Перцентиль недавних задержек, после которого отправляется дубликат
+            (0 — не хеджировать, задержки всё равно собираются для статистики).
+        min_delay: Порог не меньше этого, сек.
+        min_samples: Сколько замеров нужно, прежде чем начать хеджировать.
+        max_ratio: Доля дублей от всех запросов ключа не больше этой.
+    """
+
+    def __init__(self, *, percentile: float, min_delay: float, min_samples: int, max_ratio: float) -> None:
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self._series: dict[str, HedgeSeries] = {}
+
+    async def race(self, key: str, attempt: Callable[[], Awaitable[T]]) -> tuple[T, list[T], int]:
+        """
+        Выполняет attempt(), при задержке — ещё раз параллельно.
+
+        Returns:
+            (результат победителя, результаты проигравших попыток, успевших завершиться,
+            число отменённых попыток) — проигравшие нужны вызывающему для учёта токенов.
+        """
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = HedgeSeries()
+        series.requests += 1
+        delay = self._delay(series)
+        started = time.monotonic()
+        if delay is None:
+            result = await attempt()
+            elapsed = time.monotonic() - started
+            series.observe(elapsed, elapsed, control=True)
+            return result, [], 0
+
+        finished: dict[asyncio.Future, float] = {}
+
+        def start() -> asyncio.Future:
+            task = asyncio.ensure_future(attempt())
+            task.add_done_callback(lambda done: finished.setdefault(done, time.monotonic()))
+            return task
+
+        primary = start()
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                series.hedged += 1
+                tasks.append(start())
+            winner = await _first_success(tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        losers = [task.result() for task in tasks if task is not winner and _succeeded(task)]
+        cancelled = sum(1 for task in tasks if task.cancelled())
+        if winner is not primary:
+            series.hedge_wins += 1
+        if _succeeded(primary):
+            primary_elapsed = finished[primary] - started
+        else:
+            primary_elapsed = math.inf if primary.cancelled() else None
+        series.observe(primary_elapsed, finished[winner] - started, control=False)
+        return winner.result(), losers, cancelled
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        По ключам: запросы, доля дублей, победы дублей, порог и p99 задержки нехеджированных
+        запросов (оценка «без хеджирования») и всех запросов, сек.
+        """
+        result = {}
+        for key, series in self._series.items():
+            p99_primary = _percentile(list(series.control), 99)
+            p99_effective = _percentile(list(series.effective), 99)
+            result[key] = {
+                "requests": series.requests,
+                "hedged": series.hedged,
+                "hedge_rate": series.hedged / series.requests if series.requests else 0.0,
+                "hedge_wins": series.hedge_wins,
+                "threshold": series.threshold if series.threshold and math.isfinite(series.threshold) else 0.0,
+                "p99_primary": p99_primary,
+                "p99_effective": p99_effective,
+                "p99_improvement": 1 - p99_effective / p99_primary if p99_primary else 0.0,
+            }
+        return result
+
+    def _delay(self, series: HedgeSeries) -> float | None:
+        """Через сколько секунд отправить дубликат; None — не хеджировать."""
+        if self.percentile <= 0 or len(series.primary) < self.min_samples:
+            return None
+        if series.requests % CONTROL_EVERY == 0 or series.hedged >= self.max_ratio * series.requests:
+            return None
+        if series.threshold is None or series._fresh >= _THRESHOLD_REFRESH:
+            series.threshold = max(self.min_delay, _percentile(list(series.primary), self.percentile))
+            series._fresh = 0
+        # Перцентиль пришёлся на отменённые попытки — данных мало, не хеджируем
+        return series.threshold if math.isfinite(series.threshold) else None
+
+
+def _succeeded(task: asyncio.Future) -> bool:
+    return task.done() and not task.cancelled() and task.exception() is None
+
+
+async def _first_success(tasks: list[asyncio.Future]) -> asyncio.Future:
+    """Первая успешно завершившаяся попытка; если упали все — исключение первой упавшей."""
+    pending = set(tasks)
+    error: BaseException | None = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in tasks:
+            if task in done:
+                if _succeeded(task):
+                    return task
+                if error is None and not task.cancelled():
+                    error = task.exception()
+        # До отправки дубликата ошибку основной попытки не маскируем
+        if len(tasks) == 1 and error is not None:
+            break
+    raise error
@@ -3,12 +3,16 @@
 Интерактивный CLI для запросов к OpenAI API.
 Диалог: промпт (роль, контекст, задача, формат) + параметры → подтверждение → запрос.
 После ответа возможен дозапрос или начало заново.
+
+python main.py batch prompts.jsonl — пакетный режим без диалога (см. batch.py).
+python main.py compare --models a,b --temperatures 0,0.7 — тот же диалог, но запрос уходит
+параллельно всем сочетаниям моделей и температур (см. compare.py).
 """
 
 import sys
 
 from config import OPENAI_API_KEY, OPENAI_MODEL
-from openai_client import get_chat_response
+from openai_client import close_client, get_chat_response
 
 TEMPERATURE_MIN = 0.0
 TEMPERATURE_MAX = 2.0
@@ -19,9 +23,10 @@ COMMAND_NEW = "/new"
 COMMAND_QUIT = "/quit"
 
 
-def _print_header() -> None:
+def _print_header(models: list[str]) -> None:
+    label = "модель" if len(models) == 1 else "модели"
     print("\n  ╭─────────────────────────────────────────╮")
-    print(f"  │   Запрос к OpenAI (модель {OPENAI_MODEL})    │")
+    print(f"  │   Запрос к OpenAI ({label} {', '.join(models)})    │")
     print("  ╰─────────────────────────────────────────╯\n")
 
 
@@ -49,7 +54,16 @@ def collect_prompt() -> tuple[list[dict[str, str]], str]:
     context = _ask_optional("контекст", "Контекст (необязательно, Enter — пропустить): ")
     task = _ask_required("задача", "Задача (обязательно): ")
     output_format = _ask_optional("формат", "Формат ответа (необязательно, Enter — пропустить): ")
+    return build_messages(role, context, task, output_format)
+
 
+def build_messages(
+    role: str, context: str, task: str, output_format: str
+) -> tuple[list[dict[str, str]], str]:
+    """
+    Собирает из полей промпта сообщения для API: роль — system, остальное — одно сообщение user.
+    Возвращает (messages для API, итоговая строка промпта для показа пользователю).
+    """
     parts_display = []
     if role:
         parts_display.append(f"Роль: {role}")
@@ -74,23 +88,28 @@ def collect_prompt() -> tuple[list[dict[str, str]], str]:
     return messages, display_prompt
 
 
-def collect_parameters() -> tuple[float, int]:
-    """Собирает часть «Параметры»: температура и макс. токенов."""
+def collect_parameters(*, ask_temperature: bool = True) -> tuple[float, int]:
+    """
+    Собирает часть «Параметры»: температура и макс. токенов.
+    ask_temperature=False — температуры заданы заранее (compare), возвращается значение по умолчанию.
+    """
     print("\n  ─── Параметры ───\n")
-    print(f"  Допустимый интервал температуры: {TEMPERATURE_MIN} — {TEMPERATURE_MAX}")
-    hint_t = f"  Температура (Enter = {DEFAULT_TEMPERATURE}): "
-    while True:
-        raw = input(hint_t).strip()
-        if not raw:
-            temperature = DEFAULT_TEMPERATURE
-            break
-        try:
-            temperature = float(raw)
-            if TEMPERATURE_MIN <= temperature <= TEMPERATURE_MAX:
+    temperature = DEFAULT_TEMPERATURE
+    if ask_temperature:
+        print(f"  Допустимый интервал температуры: {TEMPERATURE_MIN} — {TEMPERATURE_MAX}")
+        hint_t = f"  Температура (Enter = {DEFAULT_TEMPERATURE}): "
+        while True:
+            raw = input(hint_t).strip()
+            if not raw:
+                temperature = DEFAULT_TEMPERATURE
                 break
-        except ValueError:
-            pass
-        print(f"  ⚠ Введите число от {TEMPERATURE_MIN} до {TEMPERATURE_MAX}.")
+            try:
+                temperature = float(raw)
+                if TEMPERATURE_MIN <= temperature <= TEMPERATURE_MAX:
+                    break
+            except ValueError:
+                pass
+            print(f"  ⚠ Введите число от {TEMPERATURE_MIN} до {TEMPERATURE_MAX}.")
 
     hint_m = f"  Максимальное количество токенов в ответе (Enter = {DEFAULT_MAX_TOKENS}): "
     while True:
@@ -109,37 +128,44 @@ def collect_parameters() -> tuple[float, int]:
     return temperature, max_tokens
 
 
-def confirm_and_send(
-    messages: list[dict[str, str]],
-    display_prompt: str,
-    temperature: float,
-    max_tokens: int,
-) -> tuple[str | None, dict[str, int] | None]:
-    """
-    Показывает итог, запрашивает согласие. При «да» — запрос к API.
-    Возвращает (content, usage) или (None, None) если пользователь не согласен.
-    """
+def confirm_prompt(display_prompt: str, parameters: list[str]) -> bool:
+    """Показывает итоговый промпт и параметры, запрашивает согласие на отправку."""
     print("\n  ╭─────────────────────────────────────────╮")
     print("  │           Итоговый промпт                 │")
     print("  ╰─────────────────────────────────────────╯\n")
     print(display_prompt)
     print("\n  Параметры:")
-    print(f"    Температура: {temperature}")
-    print(f"    Макс. токенов: {max_tokens}")
+    for line in parameters:
+        print(f"    {line}")
     print()
     while True:
         answer = input("  Отправить запрос? (да/нет): ").strip().lower()
         if answer in ("да", "yes", "y", "д"):
-            break
+            return True
         if answer in ("нет", "no", "n", "н"):
-            return None, None
+            return False
         print("  Введите «да» или «нет».")
 
+
+def confirm_and_send(
+    messages: list[dict[str, str]],
+    display_prompt: str,
+    temperature: float,
+    max_tokens: int,
+    model: str = OPENAI_MODEL,
+) -> tuple[str | None, dict[str, int] | None]:
+    """
+    Показывает итог, запрашивает согласие. При «да» — запрос к API.
+    Возвращает (content, usage) или (None, None) если пользователь не согласен.
+    """
+    if not confirm_prompt(display_prompt, [f"Температура: {temperature}", f"Макс. токенов: {max_tokens}"]):
+        return None, None
+
     print("\n  Отправляю запрос к модели...\n")
     try:
         content, usage = get_chat_response(
             messages,
-            OPENAI_MODEL,
+            model,
             temperature=temperature,
             max_tokens=max_tokens,
         )
@@ -158,29 +184,53 @@ def print_response(content: str, temperature: float, usage: dict[str, int] | Non
     print("\n  ─────────────────────────────────────────")
     print("  Сопутствующая информация:")
     print(f"    • Температура запроса:     {temperature}")
-    if usage:
+    if usage and usage.get("cache_hit"):
+        print("    • Ответ из кэша, токены не потрачены")
+    elif usage:
         print(f"    • Токенов в запросе:       {usage['prompt_tokens']}")
+        if usage.get("cached_tokens"):
+            print(f"      из них из кэша OpenAI:   {usage['cached_tokens']}")
         print(f"    • Токенов в ответе:       {usage['completion_tokens']}")
         print(f"    • Всего токенов:          {usage['total_tokens']}")
     print("  ─────────────────────────────────────────\n")
 
 
-def run_dialog_cycle() -> bool:
+def run_dialog_cycle(models: list[str] | None = None, temperatures: list[float] | None = None) -> bool:
     """
     Один цикл: сбор промпта → параметры → подтверждение → запрос (или отмена).
     После ответа: дозапрос, /new (начать заново) или /quit (выход).
     Возвращает True чтобы начать цикл заново, False для выхода из программы.
+
+    Несколько моделей или температур (main.py compare) — запрос всем сочетаниям
+    параллельно, дозапросы — на выбранном варианте.
     """
-    _print_header()
+    models = models or [OPENAI_MODEL]
+    _print_header(models)
 
     messages, display_prompt = collect_prompt()
-    temperature, max_tokens = collect_parameters()
-
-    content, usage = confirm_and_send(messages, display_prompt, temperature, max_tokens)
-    if content is None and usage is None:
-        return True  # не согласен — начать заново
-
-    print_response(content or "", temperature, usage)
+    temperature, max_tokens = collect_parameters(ask_temperature=not temperatures)
+    variants = [(model, t) for model in models for t in temperatures or [temperature]]
+    model, temperature = variants[0]
+
+    if len(variants) == 1:
+        content, usage = confirm_and_send(messages, display_prompt, temperature, max_tokens, model)
+        if content is None and usage is None:
+            return True  # не согласен — начать заново
+        print_response(content or "", temperature, usage)
+    else:
+        from compare import choose_variant, compare_variants
+
+        parameters = [
+            f"Модели: {', '.join(models)}",
+            f"Температуры: {', '.join(str(t) for t in temperatures or [temperature])}",
+            f"Макс. токенов: {max_tokens}",
+        ]
+        if not confirm_prompt(display_prompt, parameters):
+            return True
+        chosen = choose_variant(compare_variants(messages, variants, max_tokens))
+        if chosen is None:
+            return True
+        (model, temperature), content = chosen.variant, chosen.content
 
     # Цикл дозапросов
     while True:
@@ -201,7 +251,7 @@ def run_dialog_cycle() -> bool:
         try:
             content, usage = get_chat_response(
                 messages,
-                OPENAI_MODEL,
+                model,
                 temperature=temperature,
                 max_tokens=max_tokens,
             )
@@ -216,8 +266,23 @@ def main() -> None:
         print("Ошибка: задайте OPENAI_API_KEY в .env или в переменных окружения.", file=sys.stderr)
         sys.exit(1)
 
-    while run_dialog_cycle():
-        pass  # начать заново
+    if sys.argv[1:2] == ["batch"]:
+        from batch import main as batch_main
+
+        batch_main(sys.argv[2:])
+        return
+    models = temperatures = None
+    if sys.argv[1:2] == ["compare"]:
+        from compare import parse_args
+
+        args = parse_args(sys.argv[2:])
+        models, temperatures = args.models, args.temperatures
+
+    try:
+        while run_dialog_cycle(models, temperatures):
+            pass  # начать заново
+    finally:
+        close_client()
     print("  До свидания.\n")
 
 
@@ -0,0 +1,192 @@
+"""
+Небольшой реестр метрик в памяти процесса: счётчики, гистограммы и вычисляемые показатели.
+
+Запись — сложение в словаре по кортежу меток, без блокировок (всё вызывается из одного
+цикла событий), поэтому метрики можно не выключать в продакшене. Реестр отдаётся
+в текстовом формате Prometheus (render) и сводкой с оценкой перцентилей (Histogram.quantile).
+"""
+
+from bisect import bisect_left
+from collections.abc import Callable, Iterable
+
+# Границы корзин по умолчанию для длительностей, сек
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Монотонный счётчик; значения меток передаются позиционно в порядке labelnames."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def values(self) -> dict[tuple[str, ...], float]:
+        return dict(self._values)
+
+    def render(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self._values.items())
+        ]
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами корзин (как histogram в Prometheus).
+
+    Args:
+        buckets: Возрастающие верхние границы корзин; +Inf добавляется автоматически.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # метки → [счётчики по корзинам (последняя — +Inf), сумма, количество, максимум]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0, value]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+        if value > series[3]:
+            series[3] = value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def mean(self, *labels: str) -> float:
+        series = self._series.get(labels)
+        return series[1] / series[2] if series and series[2] else 0.0
+
+    def quantile(self, q: float, *labels: str) -> float:
+        """Оценка квантиля q (0..1) линейной интерполяцией внутри корзины (не больше максимума)."""
+        series = self._series.get(labels)
+        if not series or not series[2]:
+            return 0.0
+        target = q * series[2]
+        seen = 0
+        for index, in_bucket in enumerate(series[0]):
+            if in_bucket and seen + in_bucket >= target:
+                if index == len(self.buckets):
+                    return series[3]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return min(lower + (upper - lower) * (target - seen) / in_bucket, series[3])
+            seen += in_bucket
+        return series[3]
+
+    def label_sets(self) -> list[tuple[str, ...]]:
+        return sorted(self._series)
+
+    def render(self) -> list[str]:
+        lines = []
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, (counts, total, count, _) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, in_bucket in zip(bounds, counts):
+                cumulative += in_bucket
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            plain = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{plain} {_format_value(total)}")
+            lines.append(f"{self.name}_count{plain} {count}")
+        return lines
+
+
+class Gauge:
+    """Показатель, который вычисляется функцией в момент чтения (размер очереди и т. п.)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def render(self) -> list[str]:
+        try:
+            value = self.function()
+        except Exception:
+            return []
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class MetricsRegistry:
+    """Набор метрик процесса с выводом в текстовом формате Prometheus."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Counter | Histogram | Gauge] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, function: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, documentation, function))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+
+# Реестр процесса
+registry = MetricsRegistry()
@@ -1,16 +1,409 @@
 """
 Клиент для общения с OpenAI API (используется CLI и Telegram-ботом).
+
+Клиенты создаются один раз на процесс и переиспользуют пул keep-alive соединений:
+синхронный — для CLI, асинхронный — для бота.
+
+Перед отправкой запрос проходит через ограничитель RPM/TPM (rate_limiter) и при
+необходимости ждёт; ответы 429 повторяются с экспоненциальной задержкой и джиттером
+в пределах OPENAI_RETRY_DEADLINE, сетевые ошибки и 5xx — до OPENAI_MAX_RETRIES раз.
+Весь вызов ограничен дедлайном OPENAI_TIMEOUT (поток — ещё и OPENAI_FIRST_TOKEN_TIMEOUT
+до первого фрагмента), по истечении — TimeoutError. Асинхронные вызовы можно хеджировать
+(hedging.py): при задержке дольше перцентиля недавних отправляется дубликат запроса,
+оценка его токенов попадает в usage как hedge_prompt_tokens / hedge_completion_tokens.
+Одинаковые запросы можно отдавать из кэша ответов (RESPONSE_CACHE), usage у них нулевой.
 """
 
+import asyncio
 import logging
+import random
+import time
+from collections.abc import AsyncIterator
 from typing import Any
 
-from openai import OpenAI
+import httpx
+from openai import (
+    NOT_GIVEN,
+    APIConnectionError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    InternalServerError,
+    NotGiven,
+    OpenAI,
+    RateLimitError,
+)
 
-from config import OPENAI_API_KEY
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_COMPLETION_TOKENS_ESTIMATE,
+    OPENAI_FIRST_TOKEN_TIMEOUT,
+    OPENAI_HEDGE_MAX_RATIO,
+    OPENAI_HEDGE_MIN_DELAY,
+    OPENAI_HEDGE_MIN_SAMPLES,
+    OPENAI_HEDGE_PERCENTILE,
+    OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    OPENAI_MAX_RETRIES,
+    OPENAI_RETRY_DEADLINE,
+    OPENAI_RPM_LIMIT,
+    OPENAI_TIMEOUT,
+    OPENAI_TPM_LIMIT,
+    RESPONSE_CACHE,
+    RESPONSE_CACHE_DB_PATH,
+    RESPONSE_CACHE_MAX_TEMPERATURE,
+    RESPONSE_CACHE_NO_TEMPERATURE,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+)
+from hedging import Hedger
+from rate_limiter import ModelRateLimit, RateLimiter, Reservation, parse_duration
+from response_cache import ResponseCache
+from tokenizer import estimate_messages_tokens
 
 logger = logging.getLogger(__name__)
 
+_client: OpenAI | None = None
+_async_client: AsyncOpenAI | None = None
+_rate_limiter = RateLimiter(rpm=OPENAI_RPM_LIMIT, tpm=OPENAI_TPM_LIMIT)
+_hedger = Hedger(
+    percentile=OPENAI_HEDGE_PERCENTILE,
+    min_delay=OPENAI_HEDGE_MIN_DELAY,
+    min_samples=OPENAI_HEDGE_MIN_SAMPLES,
+    max_ratio=OPENAI_HEDGE_MAX_RATIO,
+)
+
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 20.0
+
+
+def _create_response_cache() -> ResponseCache | None:
+    """Кэш ответов по RESPONSE_CACHE (off — без кэша)."""
+    if RESPONSE_CACHE not in ("memory", "sqlite"):
+        if RESPONSE_CACHE != "off":
+            logger.warning("Неизвестный RESPONSE_CACHE=%r, кэш ответов выключен", RESPONSE_CACHE)
+        return None
+    return ResponseCache(
+        max_entries=RESPONSE_CACHE_SIZE,
+        ttl=RESPONSE_CACHE_TTL,
+        max_temperature=RESPONSE_CACHE_MAX_TEMPERATURE,
+        no_temperature=RESPONSE_CACHE_NO_TEMPERATURE,
+        db_path=RESPONSE_CACHE_DB_PATH if RESPONSE_CACHE == "sqlite" else None,
+    )
+
+
+_response_cache = _create_response_cache()
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_client() -> OpenAI:
+    """Возвращает общий синхронный клиент (создаётся при первом обращении)."""
+    global _client
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY не задан")
+    if _client is None:
+        # Повторы делаем сами (_retry_delay), чтобы 429 проходили через ограничитель
+        _client = OpenAI(
+            api_key=OPENAI_API_KEY,
+            max_retries=0,
+            http_client=DefaultHttpxClient(limits=_pool_limits()),
+        )
+    return _client
+
+
+def close_client() -> None:
+    """Закрывает общий синхронный клиент и его соединения; дописывает кэш ответов на диск."""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+    if _response_cache is not None:
+        _response_cache.flush()
+
+
+def init_async_client() -> AsyncOpenAI:
+    """Создаёт общий асинхронный клиент (вызывается при старте бота)."""
+    global _async_client
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY не задан")
+    if _async_client is None:
+        _async_client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(limits=_pool_limits()),
+        )
+    return _async_client
+
+
+async def close_async_client() -> None:
+    """Закрывает общий асинхронный клиент (вызывается при остановке бота); дописывает кэш ответов."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+    if _response_cache is not None:
+        await asyncio.to_thread(_response_cache.flush)
+
+
+def _build_request(
+    messages: list[dict[str, str]],
+    model: str,
+    temperature: float | None,
+    max_tokens: int | None,
+) -> dict[str, Any]:
+    kwargs: dict[str, Any] = {"model": model, "messages": messages}
+    if temperature is not None:
+        kwargs["temperature"] = temperature
+    if max_tokens is not None:
+        kwargs["max_tokens"] = max_tokens
+    return kwargs
+
+
+def _parse_usage(raw_usage: Any) -> dict[str, int] | None:
+    if not raw_usage:
+        return None
+    prompt_details = getattr(raw_usage, "prompt_tokens_details", None)
+    completion_details = getattr(raw_usage, "completion_tokens_details", None)
+    return {
+        "prompt_tokens": raw_usage.prompt_tokens,
+        "completion_tokens": raw_usage.completion_tokens,
+        "total_tokens": raw_usage.total_tokens,
+        # Часть prompt из кэша префиксов OpenAI (тарифицируется со скидкой)
+        "cached_tokens": getattr(prompt_details, "cached_tokens", None) or 0,
+        # Скрытые рассуждения модели (уже входят в completion_tokens)
+        "reasoning_tokens": getattr(completion_details, "reasoning_tokens", None) or 0,
+    }
+
+
+def _parse_response(response: Any) -> tuple[str, dict[str, int] | None]:
+    content = response.choices[0].message.content or ""
+    return content, _parse_usage(response.usage)
+
+
+def _prompt_tokens(messages: list[dict[str, str]], prompt_tokens: int | None) -> int:
+    """prompt_tokens от вызывающего (уже посчитаны, как в build_prompt) или оценка по длине текста."""
+    return prompt_tokens if prompt_tokens is not None else estimate_messages_tokens(messages)
+
+
+def _estimate_tokens(kwargs: dict[str, Any], prompt_tokens: int) -> int:
+    """Оценка токенов запроса для ограничителя: prompt + ожидаемый ответ."""
+    completion = kwargs.get("max_tokens") or OPENAI_COMPLETION_TOKENS_ESTIMATE
+    return prompt_tokens + completion
+
+
+def _call_deadline(timeout: float = OPENAI_TIMEOUT, limit: float | None = None) -> float | None:
+    """Момент дедлайна (time.monotonic) через timeout секунд, но не позже limit; None — без дедлайна."""
+    deadline = time.monotonic() + timeout if timeout > 0 else None
+    if deadline is None or limit is None:
+        return limit if deadline is None else deadline
+    return min(deadline, limit)
+
+
+def _remaining(deadline: float | None) -> float | NotGiven:
+    """Таймаут очередной попытки — остаток до дедлайна; TimeoutError, если он истёк."""
+    if deadline is None:
+        return NOT_GIVEN
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Истёк дедлайн запроса к OpenAI")
+    return remaining
+
+
+def _throttle_delay(delay: float, deadline: float | None) -> float:
+    """Ожидание места в лимитах, не дольше дедлайна (дальше _remaining даст TimeoutError)."""
+    return delay if deadline is None else max(0.0, min(delay, deadline - time.monotonic()))
+
+
+def _retry_deadline(deadline: float | None) -> float:
+    retry_deadline = time.monotonic() + OPENAI_RETRY_DEADLINE
+    return retry_deadline if deadline is None else min(retry_deadline, deadline)
+
+
+async def _wait(awaitable: Any, deadline: float | None) -> Any:
+    """await с дедлайном; по его истечении — TimeoutError."""
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        raise TimeoutError("Истёк дедлайн запроса к OpenAI") from None
+
+
+def _retry_delay(limit: ModelRateLimit, error: Exception, attempt: int, deadline: float) -> float | None:
+    """Пауза перед повтором запроса или None, если ошибку повторять не нужно."""
+    backoff = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt) * random.uniform(0.5, 1.5)
+    if isinstance(error, RateLimitError):
+        if error.code == "insufficient_quota":
+            return None
+        headers = error.response.headers
+        limit.update_from_headers(headers)
+        retry_after = parse_duration(headers.get("retry-after")) or 0.0
+        delay = max(backoff, retry_after)
+        if time.monotonic() + delay > deadline:
+            return None
+        limit.pause(delay)
+        return delay
+    if isinstance(error, (APIConnectionError, InternalServerError)) and attempt < OPENAI_MAX_RETRIES:
+        return backoff if time.monotonic() + backoff <= deadline else None
+    return None
+
+
+def _create(kwargs: dict[str, Any], deadline: float | None, prompt_tokens: int) -> tuple[Any, Reservation]:
+    """chat.completions.create через ограничитель и с повторами до дедлайна; возвращает ответ и резерв."""
+    client = get_client()
+    limit = _rate_limiter.for_model(kwargs["model"])
+    estimate = _estimate_tokens(kwargs, prompt_tokens)
+    retry_deadline = _retry_deadline(deadline)
+    attempt = 0
+    while True:
+        reservation = limit.reserve(estimate)
+        try:
+            if reservation.delay > 0:
+                time.sleep(_throttle_delay(reservation.delay, deadline))
+            raw = client.chat.completions.with_raw_response.create(**kwargs, timeout=_remaining(deadline))
+        except BaseException as e:
+            limit.commit(reservation, 0)
+            # Прерывание (Ctrl+C) не повторяется, но резерв из окна TPM всё равно снят
+            if not isinstance(e, Exception):
+                raise
+            delay = _retry_delay(limit, e, attempt, retry_deadline)
+            if delay is None:
+                logger.exception("OpenAI API error: %s", e)
+                raise
+            logger.warning("OpenAI API error, повтор через %.1f с: %s", delay, e)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        limit.update_from_headers(raw.headers)
+        return raw.parse(), reservation
+
+
+async def _create_async(
+    kwargs: dict[str, Any], deadline: float | None, prompt_tokens: int
+) -> tuple[Any, Reservation]:
+    """Асинхронный вариант _create на общем AsyncOpenAI-клиенте."""
+    client = _async_client or init_async_client()
+    limit = _rate_limiter.for_model(kwargs["model"])
+    estimate = _estimate_tokens(kwargs, prompt_tokens)
+    retry_deadline = _retry_deadline(deadline)
+    attempt = 0
+    while True:
+        reservation = limit.reserve(estimate)
+        try:
+            if reservation.delay > 0:
+                await asyncio.sleep(_throttle_delay(reservation.delay, deadline))
+            raw = await client.chat.completions.with_raw_response.create(
+                **kwargs, timeout=_remaining(deadline)
+            )
+        except BaseException as e:
+            limit.commit(reservation, 0)
+            # Отмена (проигравший дубль, закрытие бота) не повторяется, но резерв
+            # не должен оставаться в окне TPM ещё минуту
+            if not isinstance(e, Exception):
+                raise
+            delay = _retry_delay(limit, e, attempt, retry_deadline)
+            if delay is None:
+                logger.exception("OpenAI API error: %s", e)
+                raise
+            logger.warning("OpenAI API error, повтор через %.1f с: %s", delay, e)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        limit.update_from_headers(raw.headers)
+        return raw.parse(), reservation
+
+
+def _cache_lookup(kwargs: dict[str, Any]) -> tuple[str | None, str | None]:
+    """(ключ, ответ из кэша); ключ None — запрос не кэшируется или кэш выключен."""
+    if _response_cache is None:
+        return None, None
+    key = _response_cache.key_for(kwargs)
+    return key, (_response_cache.get(key) if key else None)
+
+
+async def _cache_lookup_async(kwargs: dict[str, Any]) -> tuple[str | None, str | None]:
+    """Как _cache_lookup, но диск кэша читается вне событийного цикла."""
+    if _response_cache is None:
+        return None, None
+    key = _response_cache.key_for(kwargs)
+    return key, (await _response_cache.get_async(key) if key else None)
+
+
+def _cache_store(key: str | None, content: str) -> None:
+    if key and content:
+        _response_cache.put(key, content)
+
+
+def _cache_hit_usage() -> dict[str, int]:
+    """Usage ответа из кэша: токены не тратились, cache_hit=1 — для учёта в token_usage."""
+    return {
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "cached_tokens": 0,
+        "reasoning_tokens": 0,
+        "cache_hit": 1,
+    }
+
+
+def get_response_cache_stats() -> dict[str, float]:
+    """Попадания/промахи кэша ответов (пусто, если кэш выключен)."""
+    return _response_cache.stats() if _response_cache else {}
+
+
+def _commit_usage(model: str, reservation: Reservation, usage: dict[str, int] | None) -> None:
+    if usage:
+        _rate_limiter.for_model(model).commit(reservation, usage["total_tokens"])
+
+
+def set_rate_limit_share(share: float) -> None:
+    """Доля лимитов RPM/TPM на этот процесс: 1/N, если ключ API делят N процессов."""
+    _rate_limiter.set_share(share)
+
+
+def get_rate_limit_stats() -> dict[str, dict[str, float]]:
+    """Состояние ограничителя по моделям: лимиты, заполнение окна, задержки и 429."""
+    return _rate_limiter.stats()
+
+
+def get_hedge_stats() -> dict[str, dict[str, float]]:
+    """
+    Хеджирование по ключам «модель/response» и «модель/first_token»: запросы, доля дублей,
+    победы дублей, порог и p99 задержки без хеджирования (оценка) и с ним.
+    """
+    return _hedger.stats()
+
+
+def _with_hedge_usage(
+    usage: dict[str, int] | None,
+    prompt_estimate: int,
+    losers: list[dict[str, int] | None],
+    cancelled: int,
+) -> dict[str, int] | None:
+    """
+    Добавляет в usage токены проигравших дублей: фактические у завершившихся, у отменённых —
+    оценку prompt (ответ оборван, его токены неизвестны).
+    """
+    if usage is None or not (losers or cancelled):
+        return usage
+    prompt_tokens = cancelled * prompt_estimate
+    completion_tokens = 0
+    for loser in losers:
+        if loser:
+            prompt_tokens += loser["prompt_tokens"]
+            completion_tokens += loser["completion_tokens"]
+        else:
+            prompt_tokens += prompt_estimate
+    return {**usage, "hedge_prompt_tokens": prompt_tokens, "hedge_completion_tokens": completion_tokens}
+
 
 def get_chat_response(
     messages: list[dict[str, str]],
@@ -18,6 +411,7 @@ def get_chat_response(
     *,
     temperature: float | None = None,
     max_tokens: int | None = None,
+    prompt_tokens: int | None = None,
 ) -> tuple[str, dict[str, int] | None]:
     """
     Отправляет сообщения в OpenAI Chat API и возвращает ответ и usage.
@@ -30,33 +424,172 @@ def get_chat_response(
         model: Имя модели (например gpt-5-mini-2025-08-07).
         temperature: Температура генерации (None — не передавать, для reasoning-моделей).
         max_tokens: Максимум токенов в ответе (None — не передавать, для reasoning-моделей).
+        prompt_tokens: Уже посчитанные токены messages для ограничителя (None — оценка по длине текста).
 
     Returns:
-        (content, usage_dict) — текст ответа и словарь с prompt_tokens, completion_tokens, total_tokens.
-        usage_dict может быть None при отсутствии данных в ответе.
+        (content, usage_dict) — текст ответа и словарь с prompt_tokens, completion_tokens, total_tokens,
+        cached_tokens (часть prompt из кэша префиксов OpenAI) и reasoning_tokens. usage_dict может
+        быть None при отсутствии данных в ответе. У ответа из кэша токены нулевые и есть ключ cache_hit=1.
+
+    Raises:
+        TimeoutError: ответа нет дольше OPENAI_TIMEOUT.
     """
-    if not OPENAI_API_KEY:
-        raise ValueError("OPENAI_API_KEY не задан")
+    kwargs = _build_request(messages, model, temperature, max_tokens)
+    key, cached = _cache_lookup(kwargs)
+    if cached is not None:
+        return cached, _cache_hit_usage()
+    response, reservation = _create(kwargs, _call_deadline(), _prompt_tokens(messages, prompt_tokens))
+    content, usage = _parse_response(response)
+    _commit_usage(model, reservation, usage)
+    _cache_store(key, content)
+    return content, usage
 
-    kwargs: dict[str, Any] = {"model": model, "messages": messages}
-    if temperature is not None:
-        kwargs["temperature"] = temperature
-    if max_tokens is not None:
-        kwargs["max_tokens"] = max_tokens
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
+async def get_chat_response_async(
+    messages: list[dict[str, str]],
+    model: str,
+    *,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+    prompt_tokens: int | None = None,
+) -> tuple[str, dict[str, int] | None]:
+    """
+    Асинхронный вариант get_chat_response на общем AsyncOpenAI-клиенте.
+
+    Параметры, результат и дедлайн — как у get_chat_response. Если клиент ещё не создан
+    через init_async_client, он создаётся при первом вызове. Если запрос хеджировался,
+    в usage есть hedge_prompt_tokens и hedge_completion_tokens — токены дубля.
+    """
+    kwargs = _build_request(messages, model, temperature, max_tokens)
+    key, cached = await _cache_lookup_async(kwargs)
+    if cached is not None:
+        return cached, _cache_hit_usage()
+    deadline = _call_deadline()
+    prompt_tokens = _prompt_tokens(messages, prompt_tokens)
+    (response, reservation), losers, cancelled = await _hedger.race(
+        f"{model}/response", lambda: _create_async(kwargs, deadline, prompt_tokens)
+    )
+    content, usage = _parse_response(response)
+    _commit_usage(model, reservation, usage)
+    loser_usage = []
+    for loser_response, loser_reservation in losers:
+        loser_usage.append(_parse_usage(loser_response.usage))
+        _commit_usage(model, loser_reservation, loser_usage[-1])
+    _cache_store(key, content)
+    return content, _with_hedge_usage(usage, prompt_tokens, loser_usage, cancelled)
+
+
+async def _open_stream(
+    kwargs: dict[str, Any], deadline: float | None, prompt_tokens: int
+) -> tuple[Any, Reservation, Any]:
+    """Открывает поток и ждёт первый чанк (None — поток пуст); при отмене поток закрывается."""
+    stream, reservation = await _create_async(kwargs, deadline, prompt_tokens)
     try:
-        response = client.chat.completions.create(**kwargs)
-    except Exception as e:
-        logger.exception("OpenAI API error: %s", e)
+        chunk = await _wait(stream.__anext__(), deadline)
+    except StopAsyncIteration:
+        chunk = None
+    except BaseException:
+        # Запрос уже принят — в окно TPM уходит оценка prompt
+        _rate_limiter.for_model(kwargs["model"]).commit(reservation, prompt_tokens)
+        await stream.close()
         raise
+    return stream, reservation, chunk
 
-    content = response.choices[0].message.content or ""
-    usage: dict[str, int] | None = None
-    if response.usage:
-        usage = {
-            "prompt_tokens": response.usage.prompt_tokens,
-            "completion_tokens": response.usage.completion_tokens,
-            "total_tokens": response.usage.total_tokens,
-        }
-    return content, usage
+
+class ChatStream:
+    """
+    Потоковый ответ модели: асинхронный итератор по фрагментам текста.
+
+    После окончания итерации доступны полный текст (content) и usage —
+    OpenAI присылает его последним чанком благодаря stream_options.include_usage.
+    Ответ из кэша отдаётся одним фрагментом. Хеджируется ожидание первого фрагмента:
+    проигравший поток закрывается, оценка его токенов — в usage (hedge_prompt_tokens).
+    """
+
+    def __init__(self, kwargs: dict[str, Any], prompt_tokens: int) -> None:
+        self._kwargs = kwargs
+        self._prompt_tokens = prompt_tokens
+        self._parts: list[str] = []
+        # Длина текста без склейки частей — для проверок на каждом фрагменте
+        self.content_length = 0
+        self.usage: dict[str, int] | None = None
+
+    @property
+    def content(self) -> str:
+        # Склеенный текст заменяет части: следующий вызов доклеивает только новые фрагменты
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        key, cached = await _cache_lookup_async(self._kwargs)
+        if cached is not None:
+            self._parts.append(cached)
+            self.content_length = len(cached)
+            self.usage = _cache_hit_usage()
+            yield cached
+            return
+        model = self._kwargs["model"]
+        kwargs = {**self._kwargs, "stream": True, "stream_options": {"include_usage": True}}
+        deadline = _call_deadline()
+        first_deadline = _call_deadline(OPENAI_FIRST_TOKEN_TIMEOUT, deadline)
+        try:
+            (stream, reservation, chunk), losers, cancelled = await _hedger.race(
+                f"{model}/first_token", lambda: _open_stream(kwargs, first_deadline, self._prompt_tokens)
+            )
+        except Exception as e:
+            logger.exception("OpenAI API error: %s", e)
+            raise
+        for loser_stream, loser_reservation, _ in losers:
+            # Ответ оборван, usage не придёт — в окно TPM уходит оценка prompt
+            _rate_limiter.for_model(model).commit(loser_reservation, self._prompt_tokens)
+            await loser_stream.close()
+        try:
+            while chunk is not None:
+                if chunk.usage:
+                    self.usage = _parse_usage(chunk.usage)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    self._parts.append(delta)
+                    self.content_length += len(delta)
+                    yield delta
+                try:
+                    chunk = await _wait(stream.__anext__(), deadline)
+                except StopAsyncIteration:
+                    chunk = None
+        except Exception as e:
+            logger.exception("OpenAI API error: %s", e)
+            raise
+        finally:
+            if self.usage:
+                _commit_usage(model, reservation, self.usage)
+            else:
+                # Поток оборван до usage (отмена, ошибка) — в окно TPM уходит оценка prompt
+                _rate_limiter.for_model(model).commit(reservation, self._prompt_tokens)
+            # Ответ соединения возвращается в пул и при раннем выходе потребителя
+            await stream.close()
+        self.usage = _with_hedge_usage(self.usage, self._prompt_tokens, [None] * len(losers), cancelled)
+        _cache_store(key, self.content)
+
+
+def stream_chat_response(
+    messages: list[dict[str, str]],
+    model: str,
+    *,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+    prompt_tokens: int | None = None,
+) -> ChatStream:
+    """
+    Потоковый вариант get_chat_response_async (при истечении дедлайна итерация
+    прерывается TimeoutError).
+
+    Пример:
+        stream = stream_chat_response(messages, model)
+        async for delta in stream:
+            ...
+        content, usage = stream.content, stream.usage
+    """
+    return ChatStream(
+        _build_request(messages, model, temperature, max_tokens), _prompt_tokens(messages, prompt_tokens)
+    )
@@ -0,0 +1,46 @@
+"""
+Ориентировочные тарифы OpenAI по моделям и стоимость usage (бот: /stats и метрики;
+CLI: пакетный режим). Цены за 1 млн токенов, $; актуальные — на openai.com/pricing.
+"""
+
+# Префикс имени модели → (запросы, запросы из кэша префиксов, ответы); выбирается самый длинный
+# подходящий префикс, поэтому gpt-4.1-mini не путается с gpt-4.1
+MODEL_PRICES: dict[str, tuple[float, float, float]] = {
+    "gpt-5-nano": (0.05, 0.005, 0.40),
+    "gpt-5-mini": (0.25, 0.025, 2.00),
+    "gpt-5": (1.25, 0.125, 10.00),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+# Неизвестная модель и записи без модели (до маршрутизации всё шло в gpt-5-mini)
+DEFAULT_PRICES = MODEL_PRICES["gpt-5-mini"]
+
+_PREFIXES = sorted(MODEL_PRICES, key=len, reverse=True)
+
+
+def model_prices(model: str) -> tuple[float, float, float]:
+    """(запросы, запросы из кэша, ответы) за 1 млн токенов, $."""
+    for prefix in _PREFIXES:
+        if model.startswith(prefix):
+            return MODEL_PRICES[prefix]
+    return DEFAULT_PRICES
+
+
+def usage_cost(
+    model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0
+) -> tuple[float, float, float]:
+    """Стоимость некэшированных токенов запросов, кэшированных и ответов модели, $."""
+    prompt_price, cached_price, completion_price = model_prices(model)
+    return (
+        (prompt_tokens - cached_tokens) / 1_000_000 * prompt_price,
+        cached_tokens / 1_000_000 * cached_price,
+        completion_tokens / 1_000_000 * completion_price,
+    )
+
+
+def format_price(cost_per_1m: float) -> str:
+    """Тариф для вывода: $0.25/1M."""
+    return f"${cost_per_1m:g}/1M"
@@ -0,0 +1,189 @@
+"""
+Клиентский ограничитель запросов к OpenAI по лимитам RPM/TPM для каждой модели.
+
+Запрос резервирует место в скользящем окне в 60 секунд и ждёт ровно столько, сколько
+нужно, чтобы не превысить лимиты. Лимиты и остатки уточняются по заголовкам
+x-ratelimit-* из ответов API, после 429 новые запросы к модели придерживаются до сброса.
+Если ключ API делят несколько процессов (воркеры runner.py), каждому достаётся доля лимитов.
+"""
+
+import re
+import threading
+import time
+from collections import deque
+from collections.abc import Mapping
+
+WINDOW_SECONDS = 60.0
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Разбирает длительность из заголовков OpenAI («1s», «6m0s», «20ms») в секунды."""
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _header_int(headers: Mapping[str, str], name: str) -> int | None:
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class Reservation:
+    """Место в окне лимитов: момент отправки и учтённые токены."""
+
+    __slots__ = ("at", "tokens", "delay")
+
+    def __init__(self, at: float, tokens: int, delay: float) -> None:
+        self.at = at
+        self.tokens = tokens
+        self.delay = delay
+
+
+class ModelRateLimit:
+    """
+    Скользящее окно запросов и токенов одной модели.
+
+    Args:
+        rpm: Лимит запросов в минуту (0 — неизвестен, пока не придёт из заголовков).
+        tpm: Лимит токенов в минуту (0 — неизвестен).
+        share: Доля лимитов на этот процесс (1/N, если ключ делят N процессов).
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, share: float = 1.0) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self.share = share
+        self._window: deque[Reservation] = deque()
+        self._window_tokens = 0
+        # Записи с моментом не позже этого уже вышли из окна
+        self._cutoff = float("-inf")
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+        self._throttled = 0
+        self._throttle_seconds = 0.0
+        self._rate_limited = 0
+
+    def reserve(self, tokens: int) -> Reservation:
+        """Резервирует место под запрос с оценкой tokens; delay — сколько подождать до отправки."""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            at = max(now, self._resume_at, self._window[-1].at if self._window else now)
+            rpm, tpm = self._shared(self.rpm), self._shared(self.tpm)
+            if rpm > 0 and len(self._window) >= rpm:
+                at = max(at, self._window[-rpm].at + WINDOW_SECONDS)
+            if tpm > 0:
+                # Ждём, пока из окна не выйдет столько токенов, чтобы поместился запрос
+                excess = self._window_tokens + min(tokens, tpm) - tpm
+                for entry in self._window:
+                    if excess <= 0:
+                        break
+                    excess -= entry.tokens
+                    at = max(at, entry.at + WINDOW_SECONDS)
+            reservation = Reservation(at, tokens, at - now)
+            self._window.append(reservation)
+            self._window_tokens += tokens
+            if reservation.delay > 0:
+                self._throttled += 1
+                self._throttle_seconds += reservation.delay
+            return reservation
+
+    def commit(self, reservation: Reservation, tokens: int) -> None:
+        """Заменяет оценку токенов в резерве фактическим расходом."""
+        with self._lock:
+            if reservation.at > self._cutoff:
+                self._window_tokens += tokens - reservation.tokens
+            reservation.tokens = tokens
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Уточняет лимиты и остатки по заголовкам x-ratelimit-* ответа."""
+        rpm = _header_int(headers, "x-ratelimit-limit-requests")
+        tpm = _header_int(headers, "x-ratelimit-limit-tokens")
+        remaining_requests = _header_int(headers, "x-ratelimit-remaining-requests")
+        remaining_tokens = _header_int(headers, "x-ratelimit-remaining-tokens")
+        now = time.monotonic()
+        with self._lock:
+            if rpm:
+                self.rpm = rpm
+            if tpm:
+                self.tpm = tpm
+            if remaining_requests == 0:
+                reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+                if reset:
+                    self._resume_at = max(self._resume_at, now + reset)
+            if remaining_tokens == 0:
+                reset = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                if reset:
+                    self._resume_at = max(self._resume_at, now + reset)
+
+    def pause(self, seconds: float) -> None:
+        """После 429: не отправлять запросы к модели ещё seconds секунд."""
+        with self._lock:
+            self._rate_limited += 1
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def stats(self) -> dict[str, float]:
+        """Лимиты, заполнение окна и счётчики задержек/429."""
+        with self._lock:
+            self._prune(time.monotonic())
+            return {
+                "rpm_limit": self.rpm,
+                "tpm_limit": self.tpm,
+                "share": self.share,
+                "requests_in_window": len(self._window),
+                "tokens_in_window": self._window_tokens,
+                "throttled": self._throttled,
+                "throttle_seconds": self._throttle_seconds,
+                "rate_limited": self._rate_limited,
+            }
+
+    def _shared(self, limit: int) -> int:
+        """Доля лимита на процесс (0 — лимит неизвестен)."""
+        return max(1, int(limit * self.share)) if limit > 0 else 0
+
+    def _prune(self, now: float) -> None:
+        self._cutoff = now - WINDOW_SECONDS
+        while self._window and self._window[0].at <= self._cutoff:
+            self._window_tokens -= self._window.popleft().tokens
+
+
+class RateLimiter:
+    """Ограничители по моделям; начальные лимиты общие, дальше уточняются по заголовкам."""
+
+    def __init__(self, *, rpm: int = 0, tpm: int = 0, share: float = 1.0) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self.share = share
+        self._models: dict[str, ModelRateLimit] = {}
+        self._lock = threading.Lock()
+
+    def for_model(self, model: str) -> ModelRateLimit:
+        with self._lock:
+            limit = self._models.get(model)
+            if limit is None:
+                limit = self._models[model] = ModelRateLimit(self.rpm, self.tpm, self.share)
+            return limit
+
+    def set_share(self, share: float) -> None:
+        """Доля лимитов всех моделей на этот процесс (1/N при N процессах с общим ключом)."""
+        with self._lock:
+            self.share = share
+            for limit in self._models.values():
+                limit.share = share
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            models = dict(self._models)
+        return {model: limit.stats() for model, limit in models.items()}
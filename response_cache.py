@@ -0,0 +1,229 @@
+"""
+Кэш ответов модели для одинаковых запросов: LRU в памяти и необязательный уровень в SQLite.
+
+Ключ — хэш канонического JSON из model, messages, temperature и max_tokens. Запросы
+с температурой выше max_temperature считаются недетерминированными и идут мимо кэша,
+запросы без temperature (у модели своя выборка) — тоже, если не включён no_temperature.
+
+Память проверяется синхронно; диск читается в пуле потоков (get_async), а пишет на него
+фоновый поток пакетами, поэтому в событийном цикле бота нет обращений к SQLite.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Сколько записей фоновый поток коммитит за раз
+_WRITE_BATCH = 100
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш ответов с TTL на запись.
+
+    Args:
+        max_entries: Размер LRU в памяти.
+        ttl: Время жизни записи по умолчанию, сек.
+        max_temperature: Запросы с большей температурой не кэшируются.
+        no_temperature: Кэшировать запросы без temperature (выборку модели по умолчанию
+            считать детерминированной); иначе они идут мимо кэша.
+        db_path: Путь к SQLite-файлу второго уровня (None — только память).
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int,
+        ttl: float,
+        max_temperature: float,
+        no_temperature: bool = False,
+        db_path: str | None = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.no_temperature = no_temperature
+        # key → (expires_at по time.time(), content)
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Соединение делят фоновый писатель и чтения из пула потоков
+        self._db_lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._writes: queue.Queue[tuple[str, str, float] | None] = queue.Queue()
+        self._writer: threading.Thread | None = None
+        if db_path:
+            path = Path(db_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    content TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at)"
+            )
+            self._conn.commit()
+            self._writer = threading.Thread(target=self._write_loop, name="response-cache-writer", daemon=True)
+            self._writer.start()
+        self._hits_memory = 0
+        self._hits_disk = 0
+        self._misses = 0
+        self._bypassed = 0
+
+    def key_for(self, request: dict[str, Any]) -> str | None:
+        """Ключ запроса chat.completions или None, если запрос не кэшируется."""
+        temperature = request.get("temperature")
+        if temperature is None:
+            cacheable = self.no_temperature
+        else:
+            cacheable = temperature <= self.max_temperature
+        if not cacheable:
+            with self._lock:
+                self._bypassed += 1
+            return None
+        canonical = json.dumps(
+            {
+                "model": request["model"],
+                "messages": request["messages"],
+                "temperature": temperature,
+                "max_tokens": request.get("max_tokens"),
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """Ответ из кэша или None (промах / запись устарела); диск читается синхронно — для CLI."""
+        content = self._get_memory(key)
+        if content is None and self._conn is not None:
+            content = self._get_disk(key)
+        if content is None:
+            self._count_miss()
+        return content
+
+    async def get_async(self, key: str) -> str | None:
+        """Как get, но диск читается в пуле потоков — событийный цикл не ждёт SQLite."""
+        content = self._get_memory(key)
+        if content is None and self._conn is not None:
+            content = await asyncio.to_thread(self._get_disk, key)
+        if content is None:
+            self._count_miss()
+        return content
+
+    def put(self, key: str, content: str, ttl: float | None = None) -> None:
+        """Сохраняет ответ на ttl секунд (по умолчанию — self.ttl); на диск — в фоне."""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, expires_at, content)
+        if self._writer is not None:
+            self._writes.put((key, content, expires_at))
+
+    def flush(self) -> None:
+        """Ждёт, пока фоновый поток допишет поставленные в очередь записи."""
+        if self._writer is not None:
+            self._writes.join()
+
+    def stats(self) -> dict[str, float]:
+        """Попадания (память/диск), промахи, запросы мимо кэша и доля попаданий."""
+        with self._lock:
+            hits = self._hits_memory + self._hits_disk
+            lookups = hits + self._misses
+            return {
+                "entries": len(self._memory),
+                "hits_memory": self._hits_memory,
+                "hits_disk": self._hits_disk,
+                "misses": self._misses,
+                "bypassed": self._bypassed,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+            }
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _get_memory(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > now:
+                self._memory.move_to_end(key)
+                self._hits_memory += 1
+                return entry[1]
+            if entry is not None:
+                del self._memory[key]
+            return None
+
+    def _get_disk(self, key: str) -> str | None:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT content, expires_at FROM response_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        if not row:
+            return None
+        with self._lock:
+            self._remember(key, row[1], row[0])
+            self._hits_disk += 1
+        return row[0]
+
+    def _count_miss(self) -> None:
+        with self._lock:
+            self._misses += 1
+
+    def _write_loop(self) -> None:
+        """Фоновый писатель: забирает из очереди всё накопившееся и коммитит одним пакетом."""
+        while True:
+            item = self._writes.get()
+            batch = [item] if item is not None else []
+            while item is not None and len(batch) < _WRITE_BATCH:
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    batch.append(item)
+            try:
+                if batch:
+                    with self._db_lock, self._conn:
+                        self._conn.executemany(
+                            "INSERT OR REPLACE INTO response_cache (key, content, expires_at) VALUES (?, ?, ?)",
+                            batch,
+                        )
+                        self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+            except sqlite3.Error as e:
+                # Кэш — не источник истины: запись в памяти осталась, на диске её просто не будет
+                logger.warning("Не удалось записать %d ответов в кэш на диске: %s", len(batch), e)
+            finally:
+                for _ in range(len(batch) + (item is None)):
+                    self._writes.task_done()
+            if item is None:
+                return
+
+    def _remember(self, key: str, expires_at: float, content: str) -> None:
+        self._memory[key] = (expires_at, content)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
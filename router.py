@@ -0,0 +1,229 @@
+"""
+Маршрутизация сообщений бота по моделям с переключением при сбоях.
+
+Уровни (BOT_MODEL_TIERS) идут от лёгкой модели к тяжёлой: сообщение уходит на первый
+уровень, в лимит которого помещается запрос (сообщение + история), остальные уровни —
+запасные. Модель, у которой за последние ROUTER_HEALTH_WINDOW секунд много ошибок
+или большая задержка первого фрагмента, пробуется последней; по истечении окна
+она снова получает запросы. При таймауте, сетевой ошибке или 5xx до первого фрагмента
+ответа запрос повторяется на следующей модели.
+"""
+
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable
+
+from openai import APIConnectionError, APIStatusError
+
+from openai_client import stream_chat_response
+
+logger = logging.getLogger(__name__)
+
+
+class ModelTier:
+    """Уровень маршрутизации: модель и предел токенов запроса (None — без предела)."""
+
+    __slots__ = ("model", "max_prompt_tokens")
+
+    def __init__(self, model: str, max_prompt_tokens: int | None = None) -> None:
+        self.model = model
+        self.max_prompt_tokens = max_prompt_tokens
+
+
+def parse_tiers(spec: str) -> list[ModelTier]:
+    """
+    Разбирает BOT_MODEL_TIERS: «gpt-4.1-nano:300,gpt-5-mini» — модель[:макс. токенов запроса]
+    через запятую. Имя модели может содержать двоеточия (ft:...), предел — только число в конце.
+    """
+    tiers = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        model, _, limit = part.rpartition(":")
+        if model and limit.isdigit():
+            tiers.append(ModelTier(model, int(limit)))
+        else:
+            tiers.append(ModelTier(part))
+    if not tiers:
+        raise ValueError("BOT_MODEL_TIERS не содержит ни одной модели")
+    return tiers
+
+
+def is_failover_error(error: BaseException) -> bool:
+    """Сбой модели, после которого имеет смысл спросить другую: таймаут, сеть, 5xx."""
+    if isinstance(error, (TimeoutError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+class ModelHealth:
+    """Исходы и задержки первого фрагмента модели за скользящее окно."""
+
+    __slots__ = ("samples", "routed", "failovers")
+
+    def __init__(self) -> None:
+        # (момент, задержка первого фрагмента или None, успех)
+        self.samples: deque[tuple[float, float | None, bool]] = deque()
+        self.routed = 0
+        self.failovers = 0
+
+    def prune(self, window: float) -> None:
+        cutoff = time.monotonic() - window
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, _, ok in self.samples if not ok) / len(self.samples)
+
+    def p90_latency(self) -> float:
+        latencies = sorted(latency for _, latency, ok in self.samples if ok and latency is not None)
+        return latencies[min(len(latencies) - 1, int(0.9 * len(latencies)))] if latencies else 0.0
+
+
+class ModelRouter:
+    """
+    Выбор модели для сообщения и учёт её здоровья.
+
+    Args:
+        tiers: Уровни от лёгкой модели к тяжёлой.
+        health_window: Окно учёта ошибок и задержек, сек.
+        max_error_rate: Доля ошибок в окне, выше которой модель считается деградировавшей.
+        max_latency: p90 задержки первого фрагмента в окне, выше которого — тоже, сек.
+        min_samples: Меньше стольких исходов в окне — модель считается здоровой.
+    """
+
+    def __init__(
+        self,
+        tiers: list[ModelTier],
+        *,
+        health_window: float,
+        max_error_rate: float,
+        max_latency: float,
+        min_samples: int,
+    ) -> None:
+        self.tiers = tiers
+        self.health_window = health_window
+        self.max_error_rate = max_error_rate
+        self.max_latency = max_latency
+        self.min_samples = min_samples
+        self._health = {tier.model: ModelHealth() for tier in tiers}
+
+    def candidates(self, prompt_tokens: int) -> list[str]:
+        """
+        Модели в порядке попыток: подходящий по размеру уровень, затем более тяжёлые,
+        затем более лёгкие; деградировавшие — в конце.
+        """
+        index = next(
+            (
+                i
+                for i, tier in enumerate(self.tiers)
+                if tier.max_prompt_tokens is None or prompt_tokens <= tier.max_prompt_tokens
+            ),
+            len(self.tiers) - 1,
+        )
+        order = [tier.model for tier in self.tiers[index:]] + [
+            tier.model for tier in reversed(self.tiers[:index])
+        ]
+        healthy = [model for model in order if not self.degraded(model)]
+        return healthy + [model for model in order if model not in healthy]
+
+    def degraded(self, model: str) -> bool:
+        health = self._health[model]
+        health.prune(self.health_window)
+        if len(health.samples) < self.min_samples:
+            return False
+        return health.error_rate() > self.max_error_rate or health.p90_latency() > self.max_latency
+
+    def record(self, model: str, *, latency: float | None, ok: bool, failover: bool = False) -> None:
+        """
+        Исход запроса к модели: задержка первого фрагмента (None — не дождались), успех
+        и было ли после сбоя переключение на другую модель.
+        """
+        health = self._health.setdefault(model, ModelHealth())
+        health.samples.append((time.monotonic(), latency, ok))
+        health.prune(self.health_window)
+        if ok:
+            health.routed += 1
+        if failover:
+            health.failovers += 1
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """По моделям: ответов, переключений с неё, исходов в окне, доля ошибок, p90 задержки, деградация."""
+        result = {}
+        for model, health in self._health.items():
+            health.prune(self.health_window)
+            result[model] = {
+                "routed": health.routed,
+                "failovers": health.failovers,
+                "window_requests": len(health.samples),
+                "error_rate": health.error_rate(),
+                "p90_latency": health.p90_latency(),
+                "degraded": float(self.degraded(model)),
+            }
+        return result
+
+
+class RoutedStream:
+    """
+    Потоковый ответ первой из candidates, что ответит; build_messages(model) собирает
+    запрос под модель и возвращает (messages, prompt_tokens). content_length — длина
+    полученного текста без его склейки. После итерации доступны content, usage и
+    model — модель, которая ответила (failovers — сколько раз переключались).
+    """
+
+    def __init__(
+        self,
+        router: ModelRouter,
+        candidates: list[str],
+        build_messages: Callable[[str], tuple[list[dict[str, str]], int]],
+    ) -> None:
+        self._router = router
+        self._candidates = candidates
+        self._build_messages = build_messages
+        self._stream = None
+        self.model = candidates[0]
+        self.failovers = 0
+
+    @property
+    def content(self) -> str:
+        return self._stream.content if self._stream else ""
+
+    @property
+    def content_length(self) -> int:
+        return self._stream.content_length if self._stream else 0
+
+    @property
+    def usage(self) -> dict[str, int] | None:
+        return self._stream.usage if self._stream else None
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        for index, model in enumerate(self._candidates):
+            self.model = model
+            messages, prompt_tokens = self._build_messages(model)
+            self._stream = stream_chat_response(messages, model, prompt_tokens=prompt_tokens)
+            started = time.monotonic()
+            first_delta = None
+            try:
+                async for delta in self._stream:
+                    if first_delta is None:
+                        first_delta = time.monotonic() - started
+                    yield delta
+            except Exception as e:
+                if not is_failover_error(e):
+                    raise
+                # Часть ответа уже показана пользователю — другой моделью её не заменить
+                failover = first_delta is None and index < len(self._candidates) - 1
+                self._router.record(model, latency=first_delta, ok=False, failover=failover)
+                if not failover:
+                    raise
+                self.failovers += 1
+                logger.warning("Модель %s недоступна (%s), переключаемся на %s", model, e, self._candidates[index + 1])
+                continue
+            if first_delta is None:
+                first_delta = time.monotonic() - started
+            self._router.record(model, latency=first_delta, ok=True)
+            return
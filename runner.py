@@ -0,0 +1,375 @@
+"""
+Многопроцессный запуск бота: один процесс получает обновления (long polling или вебхук)
+и раздаёт их N воркерам по user_id.
+
+Все обновления одного пользователя попадают в один воркер и приходят в нём в порядке
+получения, поэтому его контекст в памяти (_contexts) живёт в одном процессе. Каждый воркер —
+обычный экземпляр бота со своим event loop, клиентом OpenAI, планировщиком и писателем
+token_usage (SQLite в режиме WAL выдерживает запись из нескольких процессов).
+
+Диспетчер следит за воркерами: упавший или переставший отмечаться (зависший event loop)
+перезапускается. По SIGINT/SIGTERM приём обновлений прекращается, воркеры дорабатывают
+начатые запросы (до WORKER_DRAIN_TIMEOUT), дописывают контексты и token_usage и выходят.
+
+Запуск: python runner.py
+"""
+
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+from multiprocessing.sharedctypes import Synchronized
+from typing import Any
+
+from aiohttp import web
+
+from bot import bot, dp, register_webhook, share_limits
+from config import (
+    BOT_MODE,
+    BOT_MODEL_TIERS,
+    BOT_TOKEN,
+    BOT_WORKERS,
+    OPENAI_API_KEY,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WORKER_DRAIN_TIMEOUT,
+    WORKER_HEARTBEAT_INTERVAL,
+    WORKER_HEARTBEAT_TIMEOUT,
+)
+from context_manager import init_token_usage_db
+
+logger = logging.getLogger("runner")
+
+# Long polling: сколько секунд Telegram держит запрос getUpdates
+POLLING_TIMEOUT = 30
+# Пауза перед повтором getUpdates после сетевой ошибки
+POLLING_ERROR_DELAY = 5.0
+# Не перезапускать воркер чаще, чем раз в столько секунд (защита от цикла падений)
+RESTART_MIN_INTERVAL = 5.0
+
+_mp = multiprocessing.get_context("spawn")
+
+
+def shard_key(update: dict[str, Any]) -> int:
+    """
+    Ключ распределения обновления: id пользователя, иначе id чата, иначе update_id.
+
+    Смотрит на объект события (message, callback_query, poll_answer, ...) — в нём
+    отправитель лежит в «from» или «user».
+    """
+    for name, event in update.items():
+        if name == "update_id" or not isinstance(event, dict):
+            continue
+        for field in ("from", "user"):
+            user = event.get(field)
+            if isinstance(user, dict) and "id" in user:
+                return user["id"]
+        chat = event.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return update.get("update_id", 0)
+
+
+# --- Воркер ---
+
+
+def _worker_main(
+    index: int, workers: int, updates: Any, heartbeat: Synchronized, in_flight: Synchronized
+) -> None:
+    # Ctrl+C и SIGTERM (systemd, docker stop) приходят всей группе процессов — останавливает
+    # воркеры диспетчер: сначала дорабатываются запросы и дописываются данные
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # Токен бота и ключ OpenAI общие — каждому воркеру своя доля глобальных лимитов
+    share_limits(workers)
+    asyncio.run(_worker_loop(index, updates, heartbeat, in_flight))
+
+
+async def _heartbeat(heartbeat: Synchronized) -> None:
+    while True:
+        heartbeat.value = time.time()
+        await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+
+def _next_update(updates: Any) -> dict[str, Any] | None | bool:
+    """Следующее обновление, None (сигнал остановки) или False, если очередь пуста."""
+    try:
+        return updates.get(timeout=WORKER_HEARTBEAT_INTERVAL)
+    except queue.Empty:
+        return False
+
+
+async def _process(update: dict[str, Any]) -> None:
+    try:
+        await dp.feed_raw_update(bot, update)
+    except Exception:
+        logger.exception("Ошибка обработки обновления %s", update.get("update_id"))
+
+
+async def _worker_loop(index: int, updates: Any, heartbeat: Synchronized, in_flight: Synchronized) -> None:
+    await dp.emit_startup(bot=bot, worker_index=index)
+    beat = asyncio.create_task(_heartbeat(heartbeat))
+    tasks: set[asyncio.Task] = set()
+
+    def _done(task: asyncio.Task) -> None:
+        tasks.discard(task)
+        in_flight.value = len(tasks)
+
+    logger.info("Воркер %d запущен (pid %d)", index, os.getpid())
+    try:
+        while True:
+            update = await asyncio.to_thread(_next_update, updates)
+            if update is None:
+                break
+            if update is False:
+                # Диспетчер погиб, не остановив воркер (SIGTERM воркер не слушает) — выходим сами
+                if not _mp.parent_process().is_alive():
+                    logger.warning("Воркер %d: диспетчер завершился, останавливаемся", index)
+                    break
+                continue
+            task = asyncio.create_task(_process(update))
+            tasks.add(task)
+            in_flight.value = len(tasks)
+            task.add_done_callback(_done)
+        if tasks:
+            logger.info("Воркер %d: дожидаемся %d запросов", index, len(tasks))
+            _, pending = await asyncio.wait(tasks, timeout=WORKER_DRAIN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning("Воркер %d: прервано %d запросов по таймауту", index, len(pending))
+    finally:
+        beat.cancel()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+    logger.info("Воркер %d остановлен", index)
+
+
+# --- Диспетчер ---
+
+
+class Worker:
+    """Процесс-воркер, его очередь обновлений и общие с ним счётчики."""
+
+    def __init__(self, index: int, workers: int) -> None:
+        self.index = index
+        # Всего воркеров в пуле — между ними делятся глобальные лимиты
+        self.workers = workers
+        self.heartbeat = _mp.Value("d", 0.0)
+        self.in_flight = _mp.Value("i", 0)
+        self.restarts = 0
+        self.started_at = 0.0
+        self.updates: Any = None
+        self.process: Any = None
+
+    def start(self) -> None:
+        # Очередь всегда новая: погибший процесс мог умереть, держа её внутренний замок
+        self.updates = _mp.Queue()
+        self.heartbeat.value = time.time()
+        self.in_flight.value = 0
+        self.started_at = time.monotonic()
+        self.process = _mp.Process(
+            target=_worker_main,
+            args=(self.index, self.workers, self.updates, self.heartbeat, self.in_flight),
+            name=f"bot-worker-{self.index}",
+        )
+        self.process.start()
+
+    def send(self, update: dict[str, Any] | None) -> None:
+        self.updates.put(update)
+
+    def check(self) -> str | None:
+        """Причина перезапуска (процесс завершился / не отмечается) или None, если всё в порядке."""
+        if not self.process.is_alive():
+            return f"процесс завершился с кодом {self.process.exitcode}"
+        silent = time.time() - self.heartbeat.value
+        if silent > WORKER_HEARTBEAT_TIMEOUT:
+            return f"нет отметки {silent:.0f} с"
+        return None
+
+    def restart(self, reason: str) -> None:
+        logger.warning("Воркер %d: %s — перезапуск", self.index, reason)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        # Обновления, не взятые погибшим воркером, теряются вместе с его очередью
+        self.updates.close()
+        self.restarts += 1
+        self.start()
+
+    def stop(self, timeout: float) -> None:
+        self.process.join(timeout)
+        if self.process.is_alive():
+            logger.warning("Воркер %d не остановился за %.0f с — завершаем", self.index, timeout)
+            self.process.kill()
+            self.process.join()
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "pid": self.process.pid if self.process else 0,
+            "alive": bool(self.process and self.process.is_alive()),
+            "in_flight": self.in_flight.value,
+            "heartbeat_age": time.time() - self.heartbeat.value,
+            "restarts": self.restarts,
+        }
+
+
+class WorkerPool:
+    """
+    Воркеры и распределение обновлений между ними по shard_key.
+
+    Args:
+        size: Число процессов-воркеров.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.workers = [Worker(index, size) for index in range(size)]
+        self._dispatched = 0
+        self._stopping = False
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+    def dispatch(self, update: dict[str, Any]) -> None:
+        self.workers[shard_key(update) % len(self.workers)].send(update)
+        self._dispatched += 1
+
+    def check(self) -> None:
+        """Перезапускает упавшие и зависшие воркеры."""
+        if self._stopping:
+            return
+        now = time.monotonic()
+        for worker in self.workers:
+            reason = worker.check()
+            if reason and now - worker.started_at >= RESTART_MIN_INTERVAL:
+                worker.restart(reason)
+
+    def stop(self) -> None:
+        """Просит воркеры доработать начатое и ждёт их завершения."""
+        self._stopping = True
+        for worker in self.workers:
+            worker.send(None)
+        deadline = time.monotonic() + WORKER_DRAIN_TIMEOUT + WORKER_HEARTBEAT_TIMEOUT
+        for worker in self.workers:
+            worker.stop(max(deadline - time.monotonic(), 0.0))
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "dispatched": self._dispatched,
+            "workers": [worker.stats() for worker in self.workers],
+        }
+
+
+async def monitor_workers(pool: WorkerPool) -> None:
+    """Фоновая проверка воркеров каждые WORKER_HEARTBEAT_INTERVAL секунд."""
+    while True:
+        await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+        await asyncio.to_thread(pool.check)
+
+
+async def poll_updates(pool: WorkerPool) -> None:
+    """Long polling getUpdates до отмены; обновления подтверждаются следующим запросом (offset)."""
+    allowed_updates = dp.resolve_used_update_types()
+    offset: int | None = None
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=POLLING_TIMEOUT,
+                    allowed_updates=allowed_updates,
+                )
+            except Exception as e:
+                logger.warning("getUpdates: %s", e)
+                await asyncio.sleep(POLLING_ERROR_DELAY)
+                continue
+            for update in updates:
+                pool.dispatch(update.model_dump(mode="json", by_alias=True, exclude_unset=True))
+                offset = update.update_id + 1
+    finally:
+        if offset is not None:
+            # Подтверждаем розданные обновления, чтобы после рестарта они не пришли повторно
+            try:
+                await bot.get_updates(offset=offset, timeout=0, limit=1)
+            except Exception as e:
+                logger.warning("Не удалось подтвердить обновления: %s", e)
+
+
+async def serve_webhook(pool: WorkerPool, stop: asyncio.Event) -> None:
+    """Принимает вебхук, проверяет секрет и сразу отвечает 200, передав обновление воркеру."""
+
+    async def handle(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET
+        ):
+            return web.Response(status=401, text="Unauthorized")
+        pool.dispatch(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info("Вебхук-сервер слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    await register_webhook()
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def main() -> None:
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN не задан. Укажите его в .env")
+        sys.exit(1)
+    if not OPENAI_API_KEY:
+        logger.error("OPENAI_API_KEY не задан. Укажите его в .env")
+        sys.exit(1)
+    if BOT_MODE == "webhook" and WEBHOOK_URL and not WEBHOOK_SECRET:
+        logger.error("WEBHOOK_SECRET не задан: публичный вебхук принимал бы обновления от кого угодно")
+        sys.exit(1)
+
+    # Схема и миграции token_usage — один раз, до запуска воркеров
+    init_token_usage_db()
+    pool = WorkerPool(BOT_WORKERS or os.cpu_count() or 1)
+    pool.start()
+    logger.info(
+        "Бот запущен (модели: %s, режим: %s, воркеров: %d)",
+        BOT_MODEL_TIERS,
+        BOT_MODE,
+        len(pool.workers),
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    monitor = asyncio.create_task(monitor_workers(pool))
+    try:
+        if BOT_MODE == "webhook":
+            await serve_webhook(pool, stop)
+        else:
+            receiving = asyncio.create_task(poll_updates(pool))
+            await stop.wait()
+            receiving.cancel()
+            await asyncio.gather(receiving, return_exceptions=True)
+    finally:
+        logger.info("Остановка: приём обновлений прекращён, воркеры дорабатывают запросы")
+        monitor.cancel()
+        await asyncio.to_thread(pool.stop)
+        await bot.session.close()
+    logger.info("Бот остановлен: %s", pool.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
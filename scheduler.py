@@ -0,0 +1,147 @@
+"""
+Планировщик запросов к модели: общий лимит одновременных вызовов, очередь FIFO на
+пользователя и ограниченная очередь ожидания с быстрым отказом при переполнении.
+"""
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+
+class SchedulerBusy(Exception):
+    """Очередь ожидания заполнена — запрос отклонён сразу, без ожидания."""
+
+
+class SlotTicket:
+    """Место в очереди пользователя: занимается reserve() синхронно, до первого await."""
+
+    __slots__ = ("user_id", "turn", "queued_at", "waiting")
+
+    def __init__(self, user_id: int, turn: asyncio.Future) -> None:
+        self.user_id = user_id
+        # Готов, когда предыдущие запросы пользователя завершились
+        self.turn = turn
+        self.queued_at = time.monotonic()
+        # Учитывается в pending, пока не получил слот
+        self.waiting = True
+
+
+class RequestScheduler:
+    """
+    Пропускает обработку сообщений к модели с учётом лимитов.
+
+    Запросы одного пользователя выполняются строго по очереди в порядке reserve(), поэтому
+    следующий запрос видит контекст с предыдущим ответом. Место в очереди занимается
+    синхронно: обработчик берёт его до первого await, и конкурентные задачи aiogram
+    не переставляют сообщения. Всего одновременно выполняется не больше max_concurrency
+    запросов; ожидающих — не больше max_pending, сверх этого reserve() сразу бросает SchedulerBusy.
+
+    Args:
+        max_concurrency: Максимум одновременно выполняемых запросов.
+        max_pending: Максимум запросов в ожидании (по всем пользователям).
+    """
+
+    def __init__(self, *, max_concurrency: int, max_pending: int) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Очередь билетов по user_id: первый выполняется, остальные ждут своего turn
+        self._user_queues: dict[int, deque[SlotTicket]] = {}
+        self._pending = 0
+        self._active = 0
+        self._started = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._run_max = 0.0
+
+    def reserve(self, user_id: int) -> SlotTicket:
+        """
+        Занимает место в очереди пользователя без ожидания; билет передаётся в slot()
+        или, если до slot() дело не дошло, возвращается через release().
+
+        Raises:
+            SchedulerBusy: Очередь ожидания заполнена.
+        """
+        if self._pending >= self.max_pending:
+            self._rejected += 1
+            raise SchedulerBusy
+        self._pending += 1
+        queue = self._user_queues.setdefault(user_id, deque())
+        ticket = SlotTicket(user_id, asyncio.get_running_loop().create_future())
+        if not queue:
+            ticket.turn.set_result(None)
+        queue.append(ticket)
+        return ticket
+
+    def release(self, ticket: SlotTicket) -> None:
+        """Освобождает место в очереди и передаёт ход следующему запросу пользователя."""
+        queue = self._user_queues.get(ticket.user_id)
+        if queue is None or ticket not in queue:
+            return
+        if ticket.waiting:
+            # Отмена в очереди или билет так и не дошёл до slot()
+            ticket.waiting = False
+            self._pending -= 1
+        head = queue[0] is ticket
+        queue.remove(ticket)
+        if not queue:
+            del self._user_queues[ticket.user_id]
+        elif head and not queue[0].turn.done():
+            queue[0].turn.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, *, ticket: SlotTicket | None = None) -> AsyncIterator[float]:
+        """
+        Ждёт своей очереди и держит слот на время блока; возвращает время ожидания, сек.
+        ticket — место, заранее занятое reserve(); без него место занимается сейчас.
+
+        Raises:
+            SchedulerBusy: Очередь ожидания заполнена (только без ticket).
+        """
+        if ticket is None:
+            ticket = self.reserve(user_id)
+        try:
+            await asyncio.shield(ticket.turn)
+            async with self._semaphore:
+                ticket.waiting = False
+                self._pending -= 1
+                self._active += 1
+                self._started += 1
+                started = time.monotonic()
+                wait = started - ticket.queued_at
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                try:
+                    yield wait
+                finally:
+                    run = time.monotonic() - started
+                    self._active -= 1
+                    self._completed += 1
+                    self._run_total += run
+                    self._run_max = max(self._run_max, run)
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> dict[str, float]:
+        """
+        Счётчики планировщика.
+
+        Returns:
+            active, pending, completed, rejected; queue_wait_avg/max — ожидание в очереди,
+            run_avg/max — время выполнения в слоте (в основном ответ модели), сек.
+        """
+        return {
+            "active": self._active,
+            "pending": self._pending,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "queue_wait_avg": self._wait_total / self._started if self._started else 0.0,
+            "queue_wait_max": self._wait_max,
+            "run_avg": self._run_total / self._completed if self._completed else 0.0,
+            "run_max": self._run_max,
+        }
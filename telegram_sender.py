@@ -0,0 +1,258 @@
+"""
+Исходящие запросы к Telegram: разбиение длинных ответов и контроль флуда.
+
+TelegramSender — middleware сессии aiogram: каждый запрос с chat_id (sendMessage,
+editMessageText, ...) сначала берёт токен из ведра своего чата, затем из общего ведра бота,
+а ответ 429 (TelegramRetryAfter) придерживает чат на retry_after секунд и повторяется.
+split_message режет текст по абзацам, затем по строкам и словам; блок кода ``` на границе
+закрывается и открывается заново в следующей части.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины текста сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+CODE_FENCE = "```"
+# Язык блока кода (```python) переносится в следующую часть, если он не длиннее этого
+_FENCE_INFO_MAX = 20
+# Разделители в порядке предпочтения: абзац, строка, предложение, слово
+_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+# Раз в столько секунд из памяти удаляются вёдра чатов, которые успели наполниться
+_PRUNE_INTERVAL = 60.0
+
+
+def _fence_marker(line: str) -> str:
+    """
+    Открывающий маркер блока для повтора в следующей части: ``` и короткий язык (```python).
+    Код на той же строке (```json{...}) не повторяется — только ```.
+    """
+    info = line[len(CODE_FENCE) :].strip()
+    if info and len(info) <= _FENCE_INFO_MAX and all(c.isalnum() or c in "+#._-" for c in info):
+        return CODE_FENCE + info
+    return CODE_FENCE
+
+
+def _fence_after(chunk: str, fence: str | None) -> str | None:
+    """Маркер незакрытого блока кода после chunk (None — вне блока)."""
+    for line in chunk.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith(CODE_FENCE):
+            fence = None if fence else _fence_marker(stripped)
+    return fence
+
+
+def _find_cut(text: str, budget: int) -> int:
+    """Позиция разреза text не дальше budget: по самому крупному разделителю во второй половине."""
+    window = text[:budget]
+    for separator in _SEPARATORS:
+        index = window.rfind(separator)
+        if index >= budget // 2:
+            return index + len(separator)
+    for separator in _SEPARATORS:
+        index = window.rfind(separator)
+        if index > 0:
+            return index + len(separator)
+    return budget
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """
+    Делит текст на части не длиннее limit, не теряя содержимого.
+
+    Режет по границам абзацев, строк, предложений или слов (по словам — только если
+    других границ нет). Если разрез попал внутрь блока ```, блок закрывается в конце части
+    и открывается в начале следующей (с языком, если он указан: ```python).
+    """
+    # Запас под открывающий маркер с языком, перевод строки и закрывающий ```
+    if limit <= 2 * (len(CODE_FENCE) + _FENCE_INFO_MAX) + 2:
+        raise ValueError(f"limit={limit} слишком мал для разбиения с блоками кода")
+    parts: list[str] = []
+    fence: str | None = None
+    rest = text
+    while rest:
+        prefix = fence + "\n" if fence else ""
+        budget = limit - len(prefix)
+        if len(rest) <= budget:
+            parts.append(prefix + rest)
+            break
+        # Место под закрывающий ``` оставляем всегда — так разрез не зависит от содержимого
+        cut = _find_cut(rest, budget - len(CODE_FENCE) - 1)
+        chunk = rest[:cut]
+        fence_after = _fence_after(chunk, fence)
+        piece = prefix + chunk.rstrip()
+        if fence_after:
+            piece += "\n" + CODE_FENCE
+        if piece.strip():
+            parts.append(piece)
+        rest = rest[cut:].lstrip(" \n") if not fence_after else rest[cut:].lstrip("\n")
+        fence = fence_after
+    return parts
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не больше capacity про запас.
+
+    reserve() берёт токен сразу, при нехватке — в долг, и возвращает, сколько ждать,
+    поэтому ожидающие выстраиваются в порядке обращения.
+    """
+
+    __slots__ = ("rate", "capacity", "_tokens", "_updated")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        self._refill()
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def ready(self) -> bool:
+        """Есть ли токен прямо сейчас (без ожидания)."""
+        self._refill()
+        return self._tokens >= 1
+
+    def pause(self, seconds: float) -> None:
+        """Следующий токен — не раньше чем через seconds секунд."""
+        self._refill()
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+    def full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class TelegramSender(BaseRequestMiddleware):
+    """
+    Планировщик исходящих запросов бота (подключается через bot.session.middleware).
+
+    Args:
+        global_rate: Запросов в секунду на всего бота.
+        chat_rate: Запросов в секунду в личный чат.
+        chat_burst: Сколько запросов в чат можно отправить подряд без ожидания.
+        group_rate: Запросов в секунду в группу (chat_id < 0).
+        max_retries: Сколько раз повторять запрос после TelegramRetryAfter.
+    """
+
+    def __init__(
+        self,
+        *,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: float,
+        group_rate: float,
+        max_retries: int,
+    ) -> None:
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: dict[Any, TokenBucket] = {}
+        self._pruned_at = time.monotonic()
+        self._sent = 0
+        self._delayed = 0
+        self._wait_seconds = 0.0
+        self._retry_after = 0
+        self._retry_after_seconds = 0.0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getUpdates, setWebhook и прочие служебные методы — без ограничений
+            return await make_request(bot, method)
+        attempt = 0
+        while True:
+            await self._acquire(chat_id)
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._retry_after += 1
+                self._retry_after_seconds += e.retry_after
+                self._bucket(chat_id).pause(e.retry_after)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logger.warning(
+                    "Telegram RetryAfter %s с (чат %s, %s), повтор %s",
+                    e.retry_after,
+                    chat_id,
+                    method.__api_method__,
+                    attempt,
+                )
+                continue
+            self._sent += 1
+            return result
+
+    def set_global_rate(self, rate: float) -> None:
+        """Меняет общий лимит бота — например, долю процесса, когда токен делят воркеры."""
+        self._global = TokenBucket(rate, rate)
+
+    def ready(self, chat_id: Any) -> bool:
+        """Можно ли отправить в чат прямо сейчас — для необязательных правок (превью ответа)."""
+        bucket = self._chats.get(chat_id)
+        return (bucket is None or bucket.ready()) and self._global.ready()
+
+    def stats(self) -> dict[str, float]:
+        """Отправлено, отложено (и на сколько), ответов 429 (и их retry_after), чатов с ведром."""
+        return {
+            "sent": self._sent,
+            "delayed": self._delayed,
+            "wait_seconds": self._wait_seconds,
+            "retry_after": self._retry_after,
+            "retry_after_seconds": self._retry_after_seconds,
+            "chats": len(self._chats),
+        }
+
+    async def _acquire(self, chat_id: Any) -> None:
+        # Сначала очередь своего чата, затем общий лимит — чтобы токен бота не простаивал
+        for bucket in (self._bucket(chat_id), self._global):
+            delay = bucket.reserve()
+            if delay > 0:
+                self._delayed += 1
+                self._wait_seconds += delay
+                await asyncio.sleep(delay)
+
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            self._prune()
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        if now - self._pruned_at < _PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.full()]:
+            del self._chats[chat_id]
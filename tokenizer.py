@@ -0,0 +1,44 @@
+"""
+Подсчёт токенов сообщений (используется контекстом бота и ограничителем запросов).
+"""
+
+import logging
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken необязателен
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Служебные токены на каждое сообщение (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning("tiktoken недоступен, токены считаются приблизительно: %s", e)
+        return None
+
+
+@lru_cache(maxsize=256)
+def count_tokens(text: str) -> int:
+    """Число токенов сообщения с учётом служебных (tiktoken или оценка ~4 символа на токен)."""
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1 + MESSAGE_OVERHEAD_TOKENS
+    return len(encoding.encode(text)) + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_messages_tokens(messages: list[dict[str, str]]) -> int:
+    """
+    Грубая оценка prompt_tokens по длине текста (~4 символа на токен), без токенизации —
+    для ограничителя, когда точное число не передано вызывающим.
+    """
+    return sum(len(message["content"]) // 4 + 1 + MESSAGE_OVERHEAD_TOKENS for message in messages)